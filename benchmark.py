@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Runs solve_schedule.py, check_schedule.py and jam_in_course.py on
+# generated problems of increasing size, and saves the timings so that one
+# revision can be compared against another:
+#
+#   ./benchmark.py --sizes 500,2000,10000 --seeds 1,2 -r before.json
+#   (... change things ...)
+#   ./benchmark.py --sizes 500,2000,10000 --seeds 1,2 -r after.json
+#   ./benchmark.py --compare before.json after.json
+#
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from gen_instance import generate_instance, write_instance
+from optparse import OptionParser
+import sys, os, re, json, time, shutil, tempfile, subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def revision():
+    """The git revision of the scripts being benchmarked, if there is one."""
+    try:
+        rev = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+        dirty = subprocess.Popen(["git", "status", "--porcelain", "-uno"],
+            cwd=here, stdout=subprocess.PIPE).communicate()[0]
+    except OSError:
+        return "unknown"
+    rev = rev.strip() or "unknown"
+    return rev + ("+dirty" if dirty.strip() else "")
+
+def run_timed(script, args, output_path):
+    """Run one of our scripts, with its output going to output_path.
+
+    Returns (exit status, wall seconds, peak memory in kilobytes)."""
+    output_file = open(output_path, "w")
+    started = time.time()
+    child = subprocess.Popen([sys.executable, os.path.join(here, script)] + args,
+                             stdout=output_file, stderr=subprocess.STDOUT)
+    _pid, status, usage = os.wait4(child.pid, 0) # -- rusage of this child only.
+    seconds = time.time() - started
+    output_file.close()
+    return os.WEXITSTATUS(status), round(seconds, 3), usage.ru_maxrss
+
+def read_conflicts(output_path):
+    """Number of conflicts reported in a solve_schedule.py output file."""
+    for line in open(output_path):
+        match = re.match(r"^Solution.*?, (-?\d+) conflicts?:", line)
+        if match: return int(match.group(1))
+    return None
+
+def run_benchmark(opts, num_students, seed, workdir):
+    num_courses = max(opts.choices, num_students // opts.students_per_course)
+    num_teachers = max(1, (num_courses + opts.courses_per_teacher - 1) \
+                          // opts.courses_per_teacher)
+    record = {"students": num_students, "courses": num_courses,
+              "teachers": num_teachers, "slots": opts.slots, "seed": seed}
+
+    started = time.time()
+    offering, preferences, template = generate_instance(num_students,
+        num_courses, num_teachers, opts.slots, opts.choices, opts.mixing,
+        int(opts.fixed_fraction * num_courses),
+        int(opts.x_fraction * num_teachers * opts.slots), seed)
+    paths = write_instance(workdir, offering, preferences, template,
+                           opts.classlist_size, seed)
+    record["generate_seconds"] = round(time.time() - started, 3)
+
+    # The solver, with its per-phase metrics:
+    metrics_path = os.path.join(workdir, "metrics.json")
+    solved_path = os.path.join(workdir, "solved.txt")
+    # (no caches: each run should pay for parsing and building the model.)
+    solver_args = ["-t", str(opts.time_limit), "--metrics", metrics_path,
+                   "-o", solved_path, "--no-cache", "--no-model-cache"] \
+        + opts.solver_args.split()
+    if opts.gap > 0:
+        solver_args += ["--gap", "%g%%" % (100 * opts.gap)]
+    status, seconds, memory = run_timed("solve_schedule.py",
+        solver_args + ["-p", paths["combined"], paths["template"]],
+        os.path.join(workdir, "solve.log"))
+    solve = {"status": status, "wall_seconds": seconds,
+             "peak_memory_kb": memory}
+    if status == 0:
+        phases = json.load(open(metrics_path))["phases"]
+        def seconds_in(test):
+            return round(sum([p["seconds"] for p in phases \
+                              if test(p["phase"])]), 3)
+        solve["build_seconds"] = seconds_in(lambda name: name in \
+            ["variables", "objective"] or name.startswith("constraints"))
+        solve["solve_seconds"] = seconds_in(lambda name: \
+            name.startswith("solve") or name == "local search")
+        solve["peak_solver_memory_kb"] = \
+            max([p["peak_child_memory_kb"] for p in phases])
+        solve["conflicts"] = read_conflicts(solved_path)
+    record["solve"] = solve
+
+    # The checker and jam_in_course, on the schedule found:
+    schedule_path = solved_path if status == 0 else paths["template"]
+    for name, script, args in [
+            ("check", "check_schedule.py", ["-p", paths["combined"]]),
+            ("check_by_student", "check_schedule.py",
+             ["-s", "-p", paths["combined"]]),
+            ("jam", "jam_in_course.py",
+             ["-p", paths["combined"], paths["classlist"]])]:
+        status, seconds, memory = run_timed(script, args + [schedule_path],
+            os.path.join(workdir, name + ".log"))
+        record[name] = {"status": status, "wall_seconds": seconds,
+                        "peak_memory_kb": memory}
+    return record
+
+def summary_line(record):
+    solve = record["solve"]
+    return "%6d students %4d courses seed %-3d  build %7.2fs  solve %7.2fs" \
+        "  %5s conflicts  check %6.2fs  jam %6.2fs  %6d MB" \
+        % (record["students"], record["courses"], record["seed"],
+           solve.get("build_seconds", -1), solve.get("solve_seconds", -1),
+           solve.get("conflicts"), record["check"]["wall_seconds"],
+           record["jam"]["wall_seconds"],
+           max(solve["peak_memory_kb"], solve.get("peak_solver_memory_kb", 0)) \
+               // 1024)
+
+# The numbers compared between two result files:
+COMPARED = [("build", ("solve", "build_seconds")),
+            ("solve", ("solve", "solve_seconds")),
+            ("conflicts", ("solve", "conflicts")),
+            ("check", ("check", "wall_seconds")),
+            ("check -s", ("check_by_student", "wall_seconds")),
+            ("jam", ("jam", "wall_seconds")),
+            ("solve kB", ("solve", "peak_memory_kb"))]
+
+def compare_results(old, new):
+    print "Comparing %s (old) with %s (new):" % (old["revision"], new["revision"])
+    old_runs = dict(((r["students"], r["seed"]), r) for r in old["runs"])
+    for run in new["runs"]:
+        key = (run["students"], run["seed"])
+        if key not in old_runs: continue
+        print "%d students, seed %d:" % key
+        for label, (part, field) in COMPARED:
+            before = old_runs[key].get(part, {}).get(field)
+            after = run.get(part, {}).get(field)
+            if before is None or after is None: continue
+            change = ""
+            if before: change = "  (x%.2f)" % (float(after) / before)
+            print "    %-10s %12s -> %-12s%s" % (label, before, after, change)
+
+if __name__=="__main__":
+    usage = "%prog [options]\n%prog --compare <old results> <new results>"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--sizes', default="500,2000,10000",
+                      help="comma-separated numbers of students to try")
+    parser.add_option('--seeds', default="1",
+                      help="comma-separated random seeds, one run each per size")
+    parser.add_option('--students-per-course', dest="students_per_course",
+                      type="int", default=25)
+    parser.add_option('--courses-per-teacher', dest="courses_per_teacher",
+                      type="int", default=4)
+    parser.add_option('--slots', type="int", default=8)
+    parser.add_option('--choices', type="int", default=6,
+                      help="courses chosen by each student")
+    parser.add_option('--mixing', type="float", default=0.3,
+                      help="chance of a choice outside the student's stream")
+    parser.add_option('--fixed-fraction', dest="fixed_fraction", type="float",
+                      default=0.05, help="fraction of courses already placed")
+    parser.add_option('--x-fraction', dest="x_fraction", type="float",
+                      default=0.02, help="fraction of teacher/slot cells marked X")
+    parser.add_option('--classlist-size', dest="classlist_size", type="int",
+                      default=30)
+    parser.add_option('-t', '--solver-time', dest="time_limit", default="1",
+                      help="solver time limit, in minutes")
+    parser.add_option('--gap', type="float", default=0,
+                      help="stop the solver within this fraction of the lower bound, e.g. 0.05 (its --gap 5%)")
+    parser.add_option('--solver-args', dest="solver_args", default="",
+                      help="extra solve_schedule.py options")
+    parser.add_option('-r', '--results', dest="results_file", default="",
+                      help="save results to this file (default benchmark-<revision>.json)")
+    parser.add_option('--keep', dest="keep_dir", default="",
+                      help="keep the generated problems and logs in this directory")
+    parser.add_option('--compare', action="store_true", default=False,
+                      help="compare two saved results files instead of running")
+    (opts, args) = parser.parse_args()
+
+    if opts.compare:
+        if len(args) != 2:
+            parser.error("two arguments required with --compare: old and new results")
+        compare_results(json.load(open(args[0])), json.load(open(args[1])))
+        sys.exit(0)
+    if len(args) != 0:
+        parser.error("no arguments expected")
+
+    sizes = [int(size) for size in opts.sizes.split(",")]
+    seeds = [int(seed) for seed in opts.seeds.split(",")]
+    results = {"revision": revision(), "python": sys.version.split()[0],
+               "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "options": vars(opts), "runs": []}
+    if opts.results_file == "":
+        opts.results_file = "benchmark-%s.json" % results["revision"]
+
+    basedir = opts.keep_dir or tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        for num_students in sizes:
+            for seed in seeds:
+                workdir = os.path.join(basedir, "%d-%d" % (num_students, seed))
+                record = run_benchmark(opts, num_students, seed, workdir)
+                results["runs"].append(record)
+                print summary_line(record)
+                sys.stdout.flush()
+
+                # -- save as we go, so a long sweep can be stopped early.
+                output_file = open(opts.results_file, "w")
+                json.dump(results, output_file, indent=2, sort_keys=True)
+                output_file.close()
+    finally:
+        if not opts.keep_dir: shutil.rmtree(basedir)
+    print "(wrote results to " + opts.results_file + ")"
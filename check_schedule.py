@@ -3,8 +3,11 @@
 # Provided under the terms of the MIT License, as stated in LICENSE.txt.
 
 from course_selection import Preferences, Schedule, read_combined_file, \
-  gencmp_conflict, cmp_to_key
+    pairs_in_slot
 from optparse import OptionParser
+import sys, os, glob, copy
+import input_cache
+import numpy
 
 # Helper functions for formatting the final report in user-readable form:
 
@@ -51,74 +54,91 @@ def format_student_missing_course(missing_course):
 
 # Actual logic for assembling a conflict report:
 
-def gencmp_named_conflicts(schedule):
-  old_comparator = gencmp_conflict(schedule) # -- simpler criteria.
-  def comparator(conflict1, conflict2):
-    people1, courses1, timeslot1 = conflict1
-    people2, courses2, timeslot2 = conflict2
-
-    # First compare by # of people affected, largest first:
-    lendelta = -cmp(len(people1), len(people2))
-    if lendelta is not 0: return lendelta
-
-    # Then use criteria for non-named conflicts:
-    return old_comparator((courses1, timeslot1,), (courses2, timeslot2,))
-  return comparator
-
-def cmp_missing_courses(missing1, missing2):
-  people1, course1 = missing1
-  people2, course2 = missing2
-
-  # First compare by # of people affected, largest first:
-  lendelta = -cmp(len(people1), len(people2))
-  if lendelta is not 0: return lendelta
-  
-  # Then compare by course name:
-  return cmp(course1, course2)
-
-def cmp_lastname(student1, student2):
-  lastname1 = student1[student1.find(' ') + 1:]
-  lastname2 = student2[student2.find(' ') + 1:]
-  return cmp(lastname1, lastname2)
-
-def cmp_student_conflicts(student_cfl_info1, student_cfl_info2):
-  student1, cfl1, missing1 = student_cfl_info1
-  student2, cfl2, missing2 = student_cfl_info2
-
-  # First compare by # of conflicts, largest first:
-  lendelta = -cmp(len(cfl1) + len(missing1), len(cfl2) + len(missing2))
-  if lendelta is not 0: return lendelta
-  
-  # Then compare by course name:
-  return cmp_lastname(student1, student2)
+class ConflictIndex:
+  """Lookups for checking many course selections against one schedule,
+  computed once: slot_rank[slot] is the position of the slot in the
+  schedule and slot_of[course] is the slot the course is scheduled in."""
 
-def print_conflict_report(preferences, schedule):
-  # Go through the students in preferences and build conflicts, missing_courses:
+  def __init__(self, schedule):
+    self.slot_rank = dict((s, i) for i, s in enumerate(schedule.slotlist))
+    self.slot_of = schedule.courses
+
+  def moved(self, changes):
+    """A copy of the index with the courses in changes moved to new slots."""
+    index = copy.copy(self)
+    index.slot_of = dict(self.slot_of)
+    index.slot_of.update(changes)
+    return index
+
+  def conflict_key(self, conflict):
+    # -- the order of Schedule.problems_for_selection.
+    courses, timeslot = conflict
+    return (-len(courses), self.slot_rank[timeslot])
+
+  def problems_for_selection(self, course_list):
+    """Same result as Schedule.problems_for_selection, in time linear in
+    the length of course_list."""
+    timetable, missing_courses = {}, []
+    for course, _comment in course_list:
+      timeslot = self.slot_of.get(course)
+      if timeslot is None: # -- course not offered
+        missing_courses.append(course)
+      elif timeslot in timetable:
+        timetable[timeslot].append(course)
+      else:
+        timetable[timeslot] = [course]
+
+    conflicts = [(tuple(courses), timeslot,) \
+                 for timeslot, courses in timetable.items() if len(courses) > 1]
+    conflicts.sort(key=self.conflict_key)
+    missing_courses.sort() # -- in alphabetical order.
+    return conflicts, missing_courses
+
+def lastname(student):
+  return student[student.find(' ') + 1:]
+
+def group_problems(index, problems):
+  """Group the problems of many students as in the report by course.
+
+  problems gives (student, conflicts, missing courses) for each student, as
+  from index.problems_for_selection; returns (conflicts, missing_courses),
+  lists of (people, courses, timeslot) and (people, course), in the order
+  they are reported."""
   conflicts, missing_courses = {}, {}
-  for student, courses in preferences.people.items():
-    student_conflicts, student_missing_courses = \
-        schedule.problems_for_selection(courses)
+  for student, student_conflicts, student_missing_courses in problems:
     for conflict_info in student_conflicts:
       if conflict_info in conflicts:
         conflicts[conflict_info].append(student)
       else:
         conflicts[conflict_info] = [student]
-      conflicts[conflict_info].sort(key=cmp_to_key(cmp_lastname))
     for missing_course_info in student_missing_courses:
       if missing_course_info in missing_courses:
         missing_courses[missing_course_info].append(student)
       else:
         missing_courses[missing_course_info] = [student]
-      missing_courses[missing_course_info].sort(key=cmp_to_key(cmp_lastname))
 
+  # Each list of people is sorted once, by last name (the sort is stable,
+  # so students with the same last name stay in the order they came in):
   def util_combine(conflict, people):
     courses, timeslot = conflict
-    return people, courses, timeslot
+    return sorted(people, key=lastname), courses, timeslot
   conflicts = [util_combine(i, p) for i, p in conflicts.items()]
-  missing_courses = [(p, c) for c, p in missing_courses.items()]
+  missing_courses = [(sorted(p, key=lastname), c) \
+                     for c, p in missing_courses.items()]
+
+  # First by # of people affected, largest first, then as for one student:
+  conflicts.sort(key=lambda (people, courses, timeslot):
+                 (-len(people),) + index.conflict_key((courses, timeslot)))
+  missing_courses.sort(key=lambda (people, course): (-len(people), course))
+  return conflicts, missing_courses
 
-  conflicts.sort(key=cmp_to_key(gencmp_named_conflicts(schedule)))
-  missing_courses.sort(key=cmp_to_key(cmp_missing_courses))
+def print_conflict_report(preferences, schedule):
+  index = ConflictIndex(schedule)
+
+  # Go through the students in preferences and build conflicts, missing_courses:
+  problems = ((student,) + index.problems_for_selection(courses) \
+              for student, courses in preferences.people.items())
+  conflicts, missing_courses = group_problems(index, problems)
 
   # Then, print a conflict report:
   for conflict in conflicts:
@@ -127,16 +147,111 @@ def print_conflict_report(preferences, schedule):
   for course_missing in missing_courses:
     print format_missing_course(course_missing)
 
+def count_conflicts(preferences, schedule):
+  # Same measure as the solver's objective: for every pair of courses that
+  # share a slot, count the students who take both of them.
+  overlap, course_ids = preferences.course_overlap(schedule.courses.keys())
+  slot_of = [None] * len(course_ids)
+  for course, j in course_ids.items():
+    slot_of[j] = schedule.courses[course]
+  total = 0
+  for i, j in zip(*overlap.nonzero()):
+    if i < j and slot_of[i] == slot_of[j]:
+      total += overlap[i, j]
+  return int(total)
+
+def score_schedules(preferences, schedules):
+  """Score many schedules against the same preferences at once.
+
+  For each schedule, returns (conflicts, students affected, missing
+  courses): conflicts as in count_conflicts, the number of students that
+  print_student_report would list, and the number of requested courses the
+  schedule doesn't offer. With the student-by-course incidence matrix A and
+  a course-by-slot assignment matrix P for each schedule, (A P)[i, s] is
+  the number of courses student i takes in slot s; the slots of a chunk of
+  schedules are lined up side by side so one product scores them all."""
+  incidence, _person_ids, course_ids = preferences.incidence_matrix()
+  num_students = incidence.shape[0]
+  requested = incidence.sum(axis=0) > 0
+
+  scores = []
+  max_slots = max([len(s.slotlist) for s in schedules] + [1])
+  chunk_size = max(1, 2000000 // max(1, num_students * max_slots))
+  for first in range(0, len(schedules), chunk_size):
+    chunk = schedules[first:first + chunk_size]
+
+    # assignment[j, col] == 1 : course j is in the slot of column col;
+    # unscheduled[j, k] == 1 : course j isn't in the k-th schedule at all.
+    starts, num_columns = [], 0
+    for schedule in chunk:
+      starts.append(num_columns)
+      num_columns += max(1, len(schedule.slotlist))
+    assignment = numpy.zeros((len(course_ids), num_columns))
+    unscheduled = numpy.ones((len(course_ids), len(chunk)))
+    for k, schedule in enumerate(chunk):
+      slot_rank = dict((s, i) for i, s in enumerate(schedule.slotlist))
+      for course, timeslot in schedule.courses.items():
+        if course in course_ids and timeslot in slot_rank:
+          assignment[course_ids[course], starts[k] + slot_rank[timeslot]] = 1
+          unscheduled[course_ids[course], k] = 0
+
+    per_slot = numpy.dot(incidence, assignment)
+    pairs = pairs_in_slot(per_slot)
+    conflicts = numpy.add.reduceat(pairs, starts, axis=1)
+    missing = numpy.dot(incidence, unscheduled)
+    affected = ((conflicts > 0) | (missing > 0)).sum(axis=0)
+    conflicts = conflicts.sum(axis=0)
+    missing_courses = unscheduled[requested].sum(axis=0)
+    for k in range(len(chunk)):
+      scores.append((int(round(conflicts[k])), int(affected[k]),
+                     int(missing_courses[k]),))
+  return scores
+
+def schedule_paths(patterns):
+  """Expand directories (every file in them) and globs into file paths."""
+  paths = []
+  for pattern in patterns:
+    if os.path.isdir(pattern):
+      names = sorted(os.listdir(pattern))
+      matches = [os.path.join(pattern, n) for n in names if not n.startswith(".")]
+    else:
+      matches = sorted(glob.glob(pattern)) or [pattern]
+    paths.extend([p for p in matches if not os.path.isdir(p)])
+  return paths
+
+def print_batch_report(preferences, patterns):
+  schedules, names = [], []
+  for path in schedule_paths(patterns):
+    try:
+      schedules.append(input_cache.load_schedule(path, True))
+      names.append(path)
+    except (IOError, ValueError), e:
+      print "SKIPPED: %s (%s)" % (path, e)
+
+  # Rank by missing courses (leaving courses out trivially avoids conflicts),
+  # then by conflicts, then by students affected:
+  scores = score_schedules(preferences, schedules)
+  ranked = sorted(zip(scores, names),
+                  key=lambda ((conflicts, affected, missing), name):
+                  (missing, conflicts, affected, name))
+  print "Rank  Conflicts  Students affected  Missing courses  Schedule"
+  for rank, (scores, name) in enumerate(ranked, 1):
+    conflicts, affected, missing = scores
+    print "%4d  %9d  %17d  %15d  %s" % (rank, conflicts, affected, missing, name)
+
 def print_student_report(preferences, schedule):
+  index = ConflictIndex(schedule)
   conflict_lst = []
   for student, courses in preferences.people.items():
     student_conflicts, student_missing_courses = \
-        schedule.problems_for_selection(courses)
+        index.problems_for_selection(courses)
     if student_conflicts == [] and student_missing_courses == []:
       continue # -- skip the student if there are no problems.
     conflict_lst.append((student, student_conflicts, student_missing_courses,))
 
-  conflict_lst.sort(key=cmp_to_key(cmp_student_conflicts))
+  # First by # of conflicts, largest first, then by last name:
+  conflict_lst.sort(key=lambda (student, cfl, missing):
+                    (-len(cfl) - len(missing), lastname(student)))
 
   for student, student_conflicts, student_missing_courses in conflict_lst:
     print "Conflicts for: " + student
@@ -148,29 +263,53 @@ def print_student_report(preferences, schedule):
 
 if __name__=="__main__":
   # TODOXXX add -o option?
-  usage = "%prog <preferences> <schedule>\n%prog -p <preference file> <schedule>"
+  usage = "%prog <preferences> <schedule>\n%prog -p <preference file> <schedule>\n%prog -b [-p <preference file> | <preferences>] <schedules, directories or globs>..."
   parser = OptionParser(usage=usage)
   parser.add_option('-s', '--by-student', action="store_true", default=False, \
                     help="print conflict report by student, not by course")
   parser.add_option('-p', '--preferences', dest="preference_file", default="",
                     help="obtain student preferences from single file")
+  parser.add_option('-c', '--count', action="store_true", default=False, \
+                    help="only print the total number of conflicts")
+  parser.add_option('-b', '--batch', action="store_true", default=False, \
+                    help="rank many schedules, given as files, directories or globs")
+  parser.add_option('--no-cache', dest="cache", action="store_false", \
+                    default=True, help="always re-read the input files")
   (opts, args) = parser.parse_args()
+  input_cache.enabled = opts.cache
+
+  if opts.batch:
+    if opts.preference_file != "":
+      if len(args) < 1:
+        parser.error("at least one schedule required with option '-b'")
+      offering, preferences = \
+          input_cache.load_combined_file(opts.preference_file)
+    else:
+      if len(args) < 2:
+        parser.error("student preferences and at least one schedule required")
+      preferences, args = input_cache.load_preferences(args[0]), args[1:]
+    print_batch_report(preferences, args)
+    sys.exit(0)
 
   if opts.preference_file != "":
     if len(args) != 1:
       parser.error("one argument required with option '-p': schedule")
     selection_file = args[0]
-    offering, preferences = read_combined_file(opts.preference_file)
-    schedule = Schedule(selection_file, lenient=True)
+    offering, preferences = input_cache.load_combined_file(opts.preference_file)
+    schedule = input_cache.load_schedule(selection_file, True)
   else:
     if len(args) != 2:
       parser.error("two arguments required: student preferences, and schedule")
     data_dir, selection_file = args[0], args[1]
-    preferences = Preferences(data_dir)
-    schedule = Schedule(selection_file, lenient=True)
+    preferences = input_cache.load_preferences(data_dir)
+    schedule = input_cache.load_schedule(selection_file, True)
 
-  # Check for the --by-student option:
-  if opts.by_student:
+  # Check for the --count and --by-student options:
+  if opts.count:
+    num_conflicts = count_conflicts(preferences, schedule)
+    print "%d %s" % (num_conflicts, \
+                     "conflict" if num_conflicts == 1 else "conflicts")
+  elif opts.by_student:
     print_student_report(preferences, schedule)
   else:
     print_conflict_report(preferences, schedule)
@@ -1,7 +1,9 @@
 # Core logic for representing a set of course preferences and a schedule.
 # Provided under the terms of the MIT License, as stated in LICENSE.txt.
 
-import re, os
+import re, os, json
+import numpy
+from array import array
 
 # Helper functions for tabulating conflicts:
 
@@ -26,6 +28,7 @@ def cmp_to_key(mycmp):
     return K
 
 def gencmp_conflict(schedule):
+    slot_rank = dict((s, i) for i, s in enumerate(schedule.slotlist))
     def comparator(conflict1, conflict2):
         courses1, timeslot1 = conflict1
         courses2, timeslot2 = conflict2
@@ -35,11 +38,14 @@ def gencmp_conflict(schedule):
         if lendelta is not 0: return lendelta
 
         # Then compare by chronological order of slots:
-        index1 = schedule.slotlist.index(timeslot1)
-        index2 = schedule.slotlist.index(timeslot2)
-        return cmp(index1, index2)
+        return cmp(slot_rank[timeslot1], slot_rank[timeslot2])
     return comparator
 
+def pairs_in_slot(m):
+    """The pairs of courses that conflict when m courses share a slot, i.e.
+    m*(m-1)/2; m may also be a numpy array of counts."""
+    return m * (m - 1) // 2
+
 # Helper functions for reading data from files:
 
 pat_course = re.compile(r"^\s*(\b.*\b)\s*(?:\((.*)\))?\s*$")
@@ -119,18 +125,152 @@ def split_schedule_line(line):
     items = [elt.strip() for elt in items] # -- trim whitespace.
     return items[0], items[1:] # -- separate the first element from the rest.
 
+# Helper functions for writing data to files, in the formats read above:
+
+def write_combined_file(path, offering, preferences):
+    output_file = open(path, "w")
+    for teacher in sorted(offering.people):
+        courses = [course for course, _comment in offering.people[teacher]]
+        output_file.write("%s: %s\n" % (teacher, ", ".join(courses)))
+    output_file.write("\n----\n\n")
+    for course in sorted(preferences.classes):
+        students = sorted(preferences.classes[course])
+        output_file.write("%s: %s\n" % (course, ", ".join(students)))
+    output_file.close()
+
+def write_datadir(datadir, preferences):
+    """Write one preference file per person, named after the person."""
+    if not os.path.isdir(datadir): os.makedirs(datadir)
+    for name, courses in preferences.people.items():
+        filename = re.sub(r"[^A-Za-z0-9]+", "_", name) + ".txt"
+        output_file = open(os.path.join(datadir, filename), "w")
+        output_file.write(name + "\n")
+        for course, _comment in sorted(courses):
+            output_file.write(course + "\n")
+        output_file.close()
+
+def write_schedule_file(path, schedule, teachers):
+    """Write a schedule (or template) with a column for each teacher."""
+    rows = [["Timeslots"] + list(teachers)]
+    for slot in schedule.slotlist:
+        row = [slot]
+        for teacher in teachers:
+            if slot in schedule.bad_slots.get(teacher, ()):
+                row.append("X")
+            else:
+                row.append(schedule.timeslots.get(slot, {}).get(teacher, "-"))
+        rows.append(row)
+    widths = [max([len(row[i]) for row in rows]) for i in range(len(rows[0]))]
+
+    output_file = open(path, "w")
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        output_file.write(" / ".join(cells).rstrip() + "\n")
+    output_file.close()
+
 # Data structures:
 
-class Preferences:
-    """Can represent students' course preferences, or teachers' offerings."""
+def slots_state(obj):
+    """Pickle state for the classes below: every slot but the _cache, with
+    int arrays as raw bytes (arrays would otherwise pickle as lists). An
+    object opened from an enrollment store pickles as just the store's path,
+    so that worker processes map the same pages instead of copying them."""
+    if getattr(obj, "_store", None) is not None:
+        return {"_store": obj._store}
+    state = {}
+    for name in obj.__slots__:
+        if name == "_cache": continue
+        value = getattr(obj, name)
+        if isinstance(value, array):
+            value = (value.typecode, value.tostring(),)
+        state[name] = value
+    return state
+
+def set_slots_state(obj, state):
+    if state.get("_store") is not None:
+        obj.read_from_store(state["_store"])
+        return
+    for name, value in state.items():
+        if isinstance(value, tuple):
+            value = array(value[0], value[1])
+        setattr(obj, name, value)
+    obj._cache = {}
+
+class NameTable(object):
+    """Dense integer IDs for names, numbered in the order they were seen."""
+    __slots__ = ("names", "ids")
+
+    def __init__(self):
+        self.names = [] # -- names[i] is the name with ID i,
+        self.ids = {} # -- ... and ids[name] == i.
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        return (self.names,) # -- never empty, so it always gets restored.
+
+    def __setstate__(self, state):
+        self.names, = state
+        self.ids = dict((name, i) for i, name in enumerate(self.names))
+
+# An enrollment store is a directory holding one Preferences: the names of
+# the people, courses and comments in store.json (their IDs are their list
+# positions), and the choice arrays and the enrollments() CSR arrays as
+# .npy files, which are memory-mapped when the store is opened.
+
+STORE_INDEX = "store.json"
+STORE_FORMAT = "course-scheduler enrollment store"
+STORE_ARRAYS = ["person", "course", "comment", "person_is_set",
+                "indptr", "indices"]
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, STORE_INDEX))
+
+class Preferences(object):
+    """Can represent students' course preferences, or teachers' offerings.
+
+    People, courses and comments are interned in NameTables, and each
+    (person, course, comment) choice is one entry in three int arrays, in
+    the order it was added. enrollments() turns these into CSR arrays.
+    The people and classes dicts are read-only views, built on first use;
+    people[name] is a list for people from add_preferences and a set for
+    those from add_class, as it has always been.
+
+    Opened from an enrollment store (see write_store), the arrays are
+    read-only memory maps, copied into memory only if anything is added."""
+    __slots__ = ("person_table", "course_table", "comment_table",
+                 "_person_is_set", "_person", "_course", "_comment",
+                 "_store", "_cache")
 
     def __init__(self, path=None):
-        # TODO: people uses sets rather than lists
-        self.people = {} # -- could be either students or teachers.
-        self.classes = {} # TODO: use this more widely, e.g. in checker
-        if path is not None:
+        self.person_table = NameTable() # -- could be either students or teachers.
+        self.course_table = NameTable()
+        self.comment_table = NameTable()
+        self._person_is_set = bytearray()
+        self._person = array("i")
+        self._course = array("i")
+        self._comment = array("i")
+        self._store = None # -- the store the arrays are mapped from, if any.
+        self._cache = {} # -- views and CSR arrays, until the next change.
+        if path is not None and is_store(path):
+            self.read_from_store(path)
+        elif path is not None:
             self.read_from_datadir(path)
 
+    def __getstate__(self):
+        return slots_state(self)
+
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+
     def read_from_datadir(self, datadir):
         for path in os.listdir(datadir):
             path = os.path.join(datadir, path)
@@ -139,53 +279,412 @@ class Preferences:
             name, courses = read_preference_file(path)
             self.add_preferences(name, courses)
 
+    def write_store(self, path):
+        """Write these preferences as an enrollment store in directory path."""
+        if not os.path.isdir(path): os.makedirs(path)
+        if is_store(path): # -- an old store is incomplete until we're done.
+            os.remove(os.path.join(path, STORE_INDEX))
+        indptr, indices = self.enrollments()
+        arrays = {"person": self._person, "course": self._course,
+                  "comment": self._comment, "indptr": indptr,
+                  "indices": indices,
+                  "person_is_set": numpy.frombuffer(self._person_is_set,
+                                                    dtype=numpy.uint8) \
+                      if len(self._person_is_set) else numpy.zeros(0, numpy.uint8)}
+        for name in STORE_ARRAYS:
+            values = arrays[name]
+            if not isinstance(values, numpy.ndarray):
+                values = numpy.array(values, dtype=numpy.int32)
+            numpy.save(os.path.join(path, name + ".npy"), values)
+        # -- names are byte strings; latin-1 carries any bytes through JSON.
+        index = {"format": STORE_FORMAT, "version": 1,
+                 "people": self.person_table.names,
+                 "courses": self.course_table.names,
+                 "comments": self.comment_table.names}
+        index_file = open(os.path.join(path, STORE_INDEX), "w")
+        json.dump(index, index_file, encoding="latin-1")
+        index_file.close() # -- written last: the store is complete once it exists.
+
+    def read_from_store(self, path):
+        """Open an enrollment store written by write_store."""
+        index = json.load(open(os.path.join(path, STORE_INDEX)))
+        if index.get("format") != STORE_FORMAT or index.get("version") != 1:
+            raise ValueError("%s is not an enrollment store we can read" % path)
+        for attr, key in [("person_table", "people"),
+                          ("course_table", "courses"),
+                          ("comment_table", "comments")]:
+            table = NameTable()
+            table.__setstate__(([name if name is None else name.encode("latin-1")
+                                 for name in index[key]],))
+            setattr(self, attr, table)
+        arrays = dict((name, numpy.load(os.path.join(path, name + ".npy"),
+                                        mmap_mode="r")) \
+                      for name in STORE_ARRAYS)
+        self._person_is_set = arrays["person_is_set"]
+        self._person = arrays["person"]
+        self._course = arrays["course"]
+        self._comment = arrays["comment"]
+        self._store = os.path.abspath(path)
+        self._cache = {"enrollments": (arrays["indptr"], arrays["indices"])}
+
+    def _make_writable(self):
+        # -- copy mapped arrays into memory, before the first change.
+        if self._store is None: return
+        self._person_is_set = bytearray(self._person_is_set.tostring())
+        self._person = array("i", self._person.astype(numpy.int32).tostring())
+        self._course = array("i", self._course.astype(numpy.int32).tostring())
+        self._comment = array("i", self._comment.astype(numpy.int32).tostring())
+        self._store = None
+
+    def _add_choices(self, people, courses, comments, is_set):
+        # -- intern everything and append it to the choice arrays in bulk.
+        person_ids, comment_ids = self.person_table.ids, self.comment_table.ids
+        for name in people:
+            if name not in person_ids:
+                self.person_table.intern(name)
+                self._person_is_set.append(is_set)
+        self._person.extend([person_ids[name] for name in people])
+        self._course.extend(courses)
+        for comment in comments:
+            if comment not in comment_ids: self.comment_table.intern(comment)
+        self._comment.extend([comment_ids[comment] for comment in comments])
+        self._cache.clear()
+
     def add_preferences(self, name, courses):
         # Allow incremental addition from many datadirs / lines:
-        if name in self.people:
-            self.people[name].extend(courses)
-        else:
-            self.people[name] = courses
-
-        # Also update the classlists to contain the person's name:
-        for course, _comment in courses:
-            if course not in self.classes:
-                self.classes[course] = set()
-            self.classes[course].add(name)
+        self._make_writable()
+        if name not in self.person_table.ids: # -- even with no courses.
+            self.person_table.intern(name)
+            self._person_is_set.append(False)
+        self._add_choices([name] * len(courses),
+                          [self.course_table.intern(c) for c, _m in courses],
+                          [comment for _c, comment in courses], False)
 
     def add_class(self, course, students):
         # Allow incremental addition:
-        if course not in self.classes:
-            self.classes[course] = set()
-        for student, _comment in students:
-            self.classes[course].add(student)
-            # Also update the student preferences, obviously:
-            if student not in self.people:
-                self.people[student] = set()
-            self.people[student].add((course,_comment,))
-
+        self._make_writable()
+        course = self.course_table.intern(course)
+        self._add_choices([student for student, _m in students],
+                          [course] * len(students),
+                          [comment for _s, comment in students], True)
+
+    @property
+    def people(self):
+        if "people" not in self._cache:
+            people = {}
+            for i, name in enumerate(self.person_table.names):
+                people[name] = set() if self._person_is_set[i] else []
+            names = self.person_table.names
+            courses, comments = self.course_table.names, self.comment_table.names
+            for person, course, comment in zip(self._person.tolist(),
+                    self._course.tolist(), self._comment.tolist()):
+                choice = (courses[course], comments[comment],)
+                if self._person_is_set[person]:
+                    people[names[person]].add(choice)
+                else:
+                    people[names[person]].append(choice)
+            self._cache["people"] = people
+        return self._cache["people"]
+
+    @property
+    def classes(self):
+        if "classes" not in self._cache:
+            classes = dict((c, set()) for c in self.course_table.names)
+            names, courses = self.person_table.names, self.course_table.names
+            for person, course in zip(self._person.tolist(),
+                                      self._course.tolist()):
+                classes[courses[course]].add(names[person])
+            self._cache["classes"] = classes
+        return self._cache["classes"]
+
+    def enrollments(self):
+        """Return (indptr, indices), the person-by-course incidence in CSR
+        form: the courses of the person with ID p are the course IDs in
+        indices[indptr[p]:indptr[p+1]], each once, in the order added."""
+        if "enrollments" not in self._cache:
+            person = numpy.frombuffer(self._person, dtype=numpy.int32) \
+                if len(self._person) else numpy.zeros(0, numpy.int32)
+            course = numpy.frombuffer(self._course, dtype=numpy.int32) \
+                if len(self._course) else numpy.zeros(0, numpy.int32)
+            key = person.astype(numpy.int64) * max(1, len(self.course_table)) \
+                + course
+            _key, first = numpy.unique(key, return_index=True)
+            first.sort() # -- drop repeated choices, keep the order added.
+            order = first[numpy.argsort(person[first], kind="mergesort")]
+            counts = numpy.bincount(person[order],
+                                    minlength=len(self.person_table))
+            indptr = numpy.zeros(len(self.person_table) + 1, numpy.int32)
+            numpy.cumsum(counts, out=indptr[1:])
+            self._cache["enrollments"] = (indptr, course[order].copy())
+        return self._cache["enrollments"]
+
+    def restricted_to(self, courses):
+        """Return a copy that only knows about the given classes."""
+        subset = Preferences()
+        for course in courses:
+            if course in self.classes:
+                subset.add_class(course, [(p, "") for p in self.classes[course]])
+        return subset
+
+    def incidence_matrix(self, courses=None):
+        """Return (incidence, person_ids, course_ids), where incidence[i, j]
+        is 1 if person i is on the classlist of course j. The id maps take
+        names to row and column numbers; courses defaults to all classes."""
+        if courses is None: courses = self.course_table.names
+        person_ids = dict((p, i) for i, p in enumerate(sorted(self.person_table.names)))
+        course_ids = dict((c, j) for j, c in enumerate(sorted(courses)))
+
+        # Translate table IDs to rows and columns (-1 for unwanted courses):
+        row_of = numpy.zeros(len(self.person_table), int)
+        for name, i in person_ids.items():
+            row_of[self.person_table.ids[name]] = i
+        column_of = -numpy.ones(len(self.course_table), int)
+        for course, j in course_ids.items():
+            if course in self.course_table.ids:
+                column_of[self.course_table.ids[course]] = j
+
+        indptr, indices = self.enrollments()
+        rows = numpy.repeat(row_of, numpy.diff(indptr))
+        cols = column_of[indices]
+        incidence = numpy.zeros((len(person_ids), len(course_ids)))
+        incidence[rows[cols >= 0], cols[cols >= 0]] = 1
+        return incidence, person_ids, course_ids
+
+    def course_overlap(self, courses=None):
+        """Return (overlap, course_ids), where overlap[i, j] is the number of
+        people on the classlists of both course i and course j. (The diagonal
+        holds the size of each classlist.) Counted from the enrollments()
+        CSR arrays, without a people-by-courses matrix."""
+        if courses is None: courses = self.course_table.names
+        course_ids = dict((c, j) for j, c in enumerate(sorted(courses)))
+        column_of = -numpy.ones(len(self.course_table), int)
+        for course, j in course_ids.items():
+            if course in self.course_table.ids:
+                column_of[self.course_table.ids[course]] = j
+
+        _indptr, indices = self.enrollments()
+        overlap = numpy.zeros((len(course_ids), len(course_ids)), int)
+        columns = column_of[indices]
+        sizes = numpy.bincount(columns[columns >= 0], minlength=len(course_ids))
+        overlap[numpy.arange(len(course_ids)), numpy.arange(len(course_ids))] = sizes
+        low, high, counts = self._course_pairs()
+        low, high = column_of[low], column_of[high]
+        wanted = (low >= 0) & (high >= 0)
+        overlap[low[wanted], high[wanted]] = counts[wanted]
+        overlap[high[wanted], low[wanted]] = counts[wanted]
+        return overlap, course_ids
+
+    def course_adjacency(self):
+        """Return adjacency, where adjacency[course][other] is the number of
+        people on the classlists of both courses, for every pair of courses
+        that share anyone. Unlike course_overlap, this takes memory in
+        proportion to the pairs that do overlap, not to courses squared."""
+        names = self.course_table.names
+        adjacency = dict((course, {}) for course in names)
+        low, high, counts = self._course_pairs()
+        for course1, course2, count in zip(low.tolist(), high.tolist(),
+                                           counts.tolist()):
+            adjacency[names[course1]][names[course2]] = count
+            adjacency[names[course2]][names[course1]] = count
+        return adjacency
+
+    def _course_pairs(self):
+        """Return (low, high, counts): the course IDs of every pair of
+        courses that share anyone, low < high, and how many people they
+        share. Each person with k courses makes k*(k-1)/2 pairs; the people
+        with k courses are done together, as a people-by-k block."""
+        indptr, indices = self.enrollments()
+        num_courses = max(1, len(self.course_table))
+        degree = numpy.diff(indptr)
+        keys = [numpy.zeros(0, numpy.int64)]
+        for k in numpy.unique(degree[degree > 1]): # -- people with k courses:
+            starts = indptr[:-1][degree == k]
+            block = numpy.asarray(indices)[starts[:, None] + numpy.arange(k)]
+            for i in range(k):
+                for j in range(i + 1, k):
+                    low = numpy.minimum(block[:, i], block[:, j])
+                    high = numpy.maximum(block[:, i], block[:, j])
+                    keys.append(low.astype(numpy.int64) * num_courses + high)
+        pairs, counts = numpy.unique(numpy.concatenate(keys), return_counts=True)
+        return pairs // num_courses, pairs % num_courses, counts
+
+
+class Schedule(object):
+    """A (possibly partial) timetable: which teacher teaches which course in
+    which slot, plus the slots teachers can't come in ("X" marks).
+
+    Teachers, courses and slots are interned in NameTables; entries and
+    marks are kept as int arrays, in the order they were added. The
+    timeslots, courses and bad_slots dicts are read-only views, built on
+    first use."""
+    __slots__ = ("slotlist", "optimal", "lower_bound", "teacher_table",
+                 "course_table", "slot_table", "_entries", "_marks", "_cache")
 
-class Schedule:
     def __init__(self, path=None, lenient=False):
         self.slotlist = []
-        self.timeslots = {}
-        self.bad_slots = {} ## EXPERIMENTAL
-        self.courses = {}
+        self.optimal = False # -- set by solvers that prove optimality.
+        self.lower_bound = None # -- least conflicts possible, if known.
+        self.teacher_table = NameTable()
+        self.course_table = NameTable()
+        self.slot_table = NameTable()
+        self._entries = array("i") # -- (teacher, course, slot) triples.
+        self._marks = array("i") ## EXPERIMENTAL -- (teacher, slot) pairs.
+        self._cache = {}
         if path is not None:
             self.read_from_file(path, lenient)
 
+    def __getstate__(self):
+        return slots_state(self)
+
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+
     def add(self, teacher, course, timeslot):
-        if timeslot in self.timeslots:
-            self.timeslots[timeslot][teacher] = course
-        else:
-            self.timeslots[timeslot] = {teacher: course}
-        self.courses[course] = timeslot
+        self._entries.extend([self.teacher_table.intern(teacher),
+                              self.course_table.intern(course),
+                              self.slot_table.intern(timeslot)])
+        self._cache.pop("timeslots", None)
+        self._cache.pop("courses", None)
+        self._cache.pop("teacher_of", None)
+
+    def move(self, course, timeslot):
+        """Put a scheduled course in another slot, with the same teacher."""
+        course_id = self.course_table.ids.get(course)
+        for k in range(1, len(self._entries), 3):
+            if self._entries[k] == course_id:
+                self._entries[k+1] = self.slot_table.intern(timeslot)
+        self._cache.pop("timeslots", None)
+        self._cache.pop("courses", None)
+
+    @property
+    def timeslots(self):
+        if "timeslots" not in self._cache:
+            timeslots = {}
+            teachers, courses = self.teacher_table.names, self.course_table.names
+            slots = self.slot_table.names
+            for k in range(0, len(self._entries), 3):
+                teacher, course, timeslot = self._entries[k:k+3]
+                if slots[timeslot] in timeslots:
+                    timeslots[slots[timeslot]][teachers[teacher]] = courses[course]
+                else:
+                    timeslots[slots[timeslot]] = {teachers[teacher]: courses[course]}
+            self._cache["timeslots"] = timeslots
+        return self._cache["timeslots"]
+
+    @property
+    def courses(self):
+        if "courses" not in self._cache:
+            courses, slots = self.course_table.names, self.slot_table.names
+            self._cache["courses"] = dict((courses[self._entries[k+1]],
+                                           slots[self._entries[k+2]]) \
+                                          for k in range(0, len(self._entries), 3))
+        return self._cache["courses"]
+
+    def restricted_to(self, courses, teachers):
+        """Return a copy with only the given courses and teachers' marks."""
+        subset = Schedule()
+        subset.slotlist = list(self.slotlist)
+        for slot, row in self.timeslots.items():
+            for teacher, course in row.items():
+                if course in courses: subset.add(teacher, course, slot)
+        for teacher, items in self.bad_slots.items():
+            if teacher in teachers:
+                for slot in items: subset.add_bad_slot(teacher, slot)
+        return subset
+
+    # Incremental cost of changes, for trying out many changes by hand:
+
+    def use_preferences(self, preferences):
+        """Precompute what move_cost and friends need from preferences: the
+        course adjacency, i.e. which courses share how many people."""
+        self._cache["adjacency"] = preferences.course_adjacency()
+
+    def _teacher_of(self, course):
+        if "teacher_of" not in self._cache:
+            teachers, courses = self.teacher_table.names, self.course_table.names
+            self._cache["teacher_of"] = dict((courses[self._entries[k+1]],
+                                              teachers[self._entries[k]]) \
+                for k in range(0, len(self._entries), 3))
+        return self._cache["teacher_of"][course]
+
+    def _slot_weights(self, course):
+        # -- people course shares with the courses in each slot.
+        if "adjacency" not in self._cache:
+            raise ValueError("use_preferences must be called before move_cost")
+        if course not in self.courses:
+            raise ValueError("%s isn't in the schedule" % course)
+        weights, slot_of = {}, self.courses
+        for other, count in self._cache["adjacency"].get(course, {}).items():
+            timeslot = slot_of.get(other)
+            if timeslot is not None:
+                weights[timeslot] = weights.get(timeslot, 0) + count
+        return weights
+
+    def _violations(self, course, timeslot, leaving=None):
+        """(teacher clash, X mark) for course in timeslot, given that the
+        course leaving (if any) moves out of timeslot."""
+        teacher = self._teacher_of(course)
+        there = self.timeslots.get(timeslot, {}).get(teacher)
+        clash = there is not None and there not in (course, leaving)
+        return clash, timeslot in self.bad_slots.get(teacher, ())
+
+    def move_cost(self, course, timeslot):
+        """Returns (change in conflicts, teacher clash, X mark) for moving a
+        scheduled course to timeslot; takes time in proportion to the number
+        of courses it shares people with."""
+        weights = self._slot_weights(course)
+        delta = weights.get(timeslot, 0) - weights.get(self.courses[course], 0)
+        return (delta,) + self._violations(course, timeslot)
+
+    def swap_cost(self, course1, course2):
+        """Returns (change in conflicts, teacher clash, X mark) for swapping
+        the slots of two scheduled courses."""
+        slot1, slot2 = self.courses.get(course1), self.courses.get(course2)
+        weights1, weights2 = \
+            self._slot_weights(course1), self._slot_weights(course2)
+        if slot1 == slot2:
+            return 0, False, False
+        # -- each course's move counts the other as still in place: take it out.
+        shared = self._cache["adjacency"].get(course1, {}).get(course2, 0)
+        delta = weights1.get(slot2, 0) - weights1.get(slot1, 0) \
+            + weights2.get(slot1, 0) - weights2.get(slot2, 0) - 2 * shared
+        clash1, mark1 = self._violations(course1, slot2, course2)
+        clash2, mark2 = self._violations(course2, slot1, course1)
+        return delta, clash1 or clash2, mark1 or mark2
+
+    def best_slots(self, course, k=3):
+        """Returns up to k (slot, change in conflicts, teacher clash, X mark)
+        for the slots course could move to (including where it is), best
+        first: slots without a clash or mark, then by the change in conflicts."""
+        weights = self._slot_weights(course)
+        current = weights.get(self.courses[course], 0)
+        options = [(timeslot, weights.get(timeslot, 0) - current) \
+                   + self._violations(course, timeslot) \
+                   for timeslot in self.slotlist]
+        rank = dict((s, i) for i, s in enumerate(self.slotlist))
+        options.sort(key=lambda (timeslot, delta, clash, mark):
+                     (clash or mark, delta, rank[timeslot]))
+        return options[:k]
 
     ## EXPERIMENTAL
     def add_bad_slot(self, teacher, timeslot):
-        if teacher in self.bad_slots:
-            self.bad_slots[teacher].append(timeslot)
-        else:
-            self.bad_slots[teacher] = [timeslot]
+        self._marks.extend([self.teacher_table.intern(teacher),
+                            self.slot_table.intern(timeslot)])
+        self._cache.pop("bad_slots", None)
+
+    @property
+    def bad_slots(self):
+        if "bad_slots" not in self._cache:
+            bad_slots = {}
+            teachers, slots = self.teacher_table.names, self.slot_table.names
+            for k in range(0, len(self._marks), 2):
+                teacher, timeslot = teachers[self._marks[k]], slots[self._marks[k+1]]
+                if teacher in bad_slots:
+                    bad_slots[teacher].append(timeslot)
+                else:
+                    bad_slots[teacher] = [timeslot]
+            self._cache["bad_slots"] = bad_slots
+        return self._cache["bad_slots"]
 
     def read_from_file(self, path, lenient=False):
         input_file = open(path, "r")
@@ -195,6 +694,8 @@ class Schedule:
         if lenient and line.find("/") == -1:
             # for lenient-mode, parse the area between the "==="
             while not line.startswith("==="):
+                if line == "": # -- end of file, and no schedule in it.
+                    raise ValueError("no schedule found in " + path)
                 line = input_file.readline()
             line = input_file.readline() # skip another line
         _dontcare, teachers = split_schedule_line(line)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# Generates synthetic scheduling problems of any size, in the same formats
+# as the sample data: a combined preference file, per-person directories,
+# a schedule template and a class list for jam_in_course.py.
+#
+# Students belong to streams (think grades or programmes) and mostly pick
+# their courses within their own stream; --mixing sets how often they pick
+# from the whole catalogue instead, i.e. how dense the course overlaps are.
+#
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from course_selection import Preferences, Schedule, write_combined_file, \
+    write_datadir, write_schedule_file
+from optparse import OptionParser
+import os, random
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+
+def slot_names(num_slots):
+    """Day-and-period names, e.g. "Mon 1", "Mon 2", ... "Tue 1", ..."""
+    per_day = (num_slots + len(DAYS) - 1) // len(DAYS)
+    return ["%s %d" % (DAYS[i // per_day], i % per_day + 1) \
+            for i in range(num_slots)]
+
+def generate_instance(num_students, num_courses, num_teachers, num_slots,
+                      choices=6, mixing=0.3, num_fixed=0, num_x_marks=0,
+                      seed=0):
+    """Returns (offering, preferences, template) for a random problem.
+
+    Raises ValueError if the numbers can't make a feasible problem, i.e.
+    some teacher would have more courses than free slots."""
+    rng = random.Random(seed)
+    if choices > num_courses:
+        raise ValueError("students can't choose %d of %d courses" \
+                         % (choices, num_courses))
+    courses = ["Course %d" % (i + 1) for i in range(num_courses)]
+    teachers = ["Teacher %d" % (i + 1) for i in range(num_teachers)]
+    slots = slot_names(num_slots)
+
+    # Deal the courses out to the teachers:
+    offering = Preferences()
+    dealt = list(courses)
+    rng.shuffle(dealt)
+    teacher_courses = dict((t, []) for t in teachers)
+    for i, course in enumerate(dealt):
+        teacher_courses[teachers[i % num_teachers]].append(course)
+    for teacher in teachers:
+        if len(teacher_courses[teacher]) > num_slots:
+            raise ValueError("%s would teach %d courses in %d slots" \
+                             % (teacher, len(teacher_courses[teacher]), num_slots))
+        offering.add_preferences(teacher,
+                                 [(c, "") for c in teacher_courses[teacher]])
+
+    # Streams of about twice as many courses as each student picks; within
+    # a stream some courses are more popular than others:
+    num_streams = max(1, num_courses // (2 * choices))
+    streams = [courses[i::num_streams] for i in range(num_streams)]
+    popularity = dict((c, rng.uniform(0.5, 2.0)) for c in courses)
+    def pick(candidates):
+        total = sum([popularity[c] for c in candidates])
+        point = rng.uniform(0, total)
+        for course in candidates:
+            point -= popularity[course]
+            if point <= 0: return course
+        return candidates[-1]
+
+    preferences = Preferences()
+    for i in range(num_students):
+        student = "Student %d" % (i + 1)
+        stream = streams[rng.randrange(num_streams)]
+        chosen = set()
+        while len(chosen) < choices:
+            if rng.random() < mixing or len(stream) <= len(chosen):
+                chosen.add(pick(courses))
+            else:
+                chosen.add(pick(stream))
+        preferences.add_preferences(student, [(c, "") for c in sorted(chosen)])
+
+    # Fixed entries: pre-placed courses, never two for a teacher in a slot.
+    template = Schedule()
+    template.slotlist = slots
+    used = dict((t, set()) for t in teachers)
+    teacher_of = dict((c, t) for t in teachers for c in teacher_courses[t])
+    for course in rng.sample(courses, min(num_fixed, num_courses)):
+        teacher = teacher_of[course]
+        free = [s for s in slots if s not in used[teacher]]
+        slot = rng.choice(free)
+        template.add(teacher, course, slot)
+        used[teacher].add(slot)
+
+    # "X" marks: slots a teacher can't come in, as long as enough are left.
+    cells = [(t, s) for t in teachers for s in slots if s not in used[t]]
+    rng.shuffle(cells)
+    for teacher, slot in cells:
+        if num_x_marks <= 0: break
+        unplaced = [c for c in teacher_courses[teacher] \
+                    if c not in template.courses]
+        if num_slots - len(used[teacher]) <= len(unplaced):
+            continue # -- the teacher needs every slot that's left.
+        template.add_bad_slot(teacher, slot)
+        used[teacher].add(slot)
+        num_x_marks -= 1
+
+    return offering, preferences, template
+
+def write_instance(outdir, offering, preferences, template, classlist_size=30,
+                   seed=0):
+    """Write the instance in every input format, and return the paths as a
+    dict: "combined", "students", "teachers", "template" and "classlist"."""
+    if not os.path.isdir(outdir): os.makedirs(outdir)
+    paths = {"combined": os.path.join(outdir, "preferences.txt"),
+             "students": os.path.join(outdir, "students"),
+             "teachers": os.path.join(outdir, "teachers"),
+             "template": os.path.join(outdir, "template.txt"),
+             "classlist": os.path.join(outdir, "classlist.txt")}
+    write_combined_file(paths["combined"], offering, preferences)
+    write_datadir(paths["students"], preferences)
+    write_datadir(paths["teachers"], offering)
+    write_schedule_file(paths["template"], template, sorted(offering.people))
+
+    # A class list for jam_in_course.py, e.g. a new section of some course:
+    students = sorted(preferences.people)
+    classlist = random.Random(seed).sample(students,
+                                           min(classlist_size, len(students)))
+    output_file = open(paths["classlist"], "w")
+    for student in classlist:
+        output_file.write(student + "\n")
+    output_file.close()
+    return paths
+
+if __name__=="__main__":
+    usage = "%prog [options] <output directory>"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--students', type="int", default=500,
+                      help="number of students (default 500)")
+    parser.add_option('--courses', type="int", default=0,
+                      help="number of courses (default: one per 25 students)")
+    parser.add_option('--teachers', type="int", default=0,
+                      help="number of teachers (default: one per 4 courses)")
+    parser.add_option('--slots', type="int", default=8,
+                      help="number of timeslots (default 8)")
+    parser.add_option('--choices', type="int", default=6,
+                      help="courses chosen by each student (default 6)")
+    parser.add_option('--mixing', type="float", default=0.3,
+                      help="chance that a choice is from outside the student's stream, 0 to 1 (default 0.3)")
+    parser.add_option('--fixed', type="int", default=0,
+                      help="number of courses already placed in the template")
+    parser.add_option('--x-marks', dest="x_marks", type="int", default=0,
+                      help="number of 'teacher can't come in' marks in the template")
+    parser.add_option('--classlist-size', dest="classlist_size", type="int",
+                      default=30, help="students in the generated class list")
+    parser.add_option('--seed', type="int", default=0,
+                      help="random seed; the same seed gives the same files")
+    (opts, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("one argument required: output directory")
+    if opts.courses <= 0: opts.courses = max(opts.choices, opts.students // 25)
+    if opts.teachers <= 0: opts.teachers = max(1, (opts.courses + 3) // 4)
+
+    try:
+        offering, preferences, template = generate_instance(opts.students,
+            opts.courses, opts.teachers, opts.slots, opts.choices, opts.mixing,
+            opts.fixed, opts.x_marks, opts.seed)
+    except ValueError, e:
+        parser.error(str(e))
+    paths = write_instance(args[0], offering, preferences, template,
+                           opts.classlist_size, opts.seed)
+
+    print "Generated %d students, %d courses, %d teachers and %d slots." \
+        % (opts.students, opts.courses, opts.teachers, opts.slots)
+    print "Try e.g.:"
+    print "    ./solve_schedule.py -p %s %s" % (paths["combined"], paths["template"])
+    print "    ./solve_schedule.py %s %s %s" \
+        % (paths["students"], paths["teachers"], paths["template"])
+    print "    ./jam_in_course.py -p %s %s %s" \
+        % (paths["combined"], paths["classlist"], paths["template"])
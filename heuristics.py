@@ -0,0 +1,188 @@
+# Fast constructive heuristics for the scheduling problem, used to give the
+# ILP solver a feasible starting schedule.
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+import math, random, time
+
+def count_assignment_conflicts(assignment, overlap):
+    """Number of conflicts in a {course: slot} map, given the (ordered-pair)
+    overlap table from gen_schedules."""
+    total = 0
+    for (course1, course2), overlap_size in overlap.items():
+        if course1 < course2 and course1 in assignment \
+                and assignment.get(course1) == assignment.get(course2):
+            total += overlap_size
+    return total
+
+def dsatur_assignment(courses, slots, teacher_courses, overlap,
+                      fixed_entries=(), forbidden_entries=()):
+    """Colour the course-overlap graph with the slots, DSatur-style.
+
+    Courses taught by the same teacher may never share a slot (2), fixed
+    entries stay where the template puts them (4), and courses are never
+    placed in slots their teacher marked "X" (5). Among the allowed slots
+    each course goes where it adds the fewest conflicts. The next course
+    to place is the one with the fewest allowed slots left, then the one
+    with the most students in common with courses already placed.
+
+    Returns a {course: slot} map, or None if some course can't be placed."""
+    neighbours = dict((c, []) for c in courses)
+    degree = dict((c, 0) for c in courses)
+    for (course1, course2), overlap_size in overlap.items():
+        if course1 in neighbours and course2 in neighbours:
+            neighbours[course1].append((course2, overlap_size))
+            degree[course1] += overlap_size
+    colleagues = dict((c, set()) for c in courses)
+    for course_list in teacher_courses.values():
+        for course in course_list:
+            if course in colleagues:
+                colleagues[course].update(course_list)
+
+    # allowed[course] == slots still open; cost[course][slot] == conflicts
+    # the course would add in the slot, given the courses placed so far.
+    allowed = dict((c, set(slots)) for c in courses)
+    for slot, course in forbidden_entries:
+        if course in allowed: allowed[course].discard(slot)
+    cost = dict((c, dict((s, 0) for s in slots)) for c in courses)
+    pressure = dict((c, 0) for c in courses)
+
+    assignment = {}
+    def place(course, slot):
+        assignment[course] = slot
+        for other, overlap_size in neighbours[course]:
+            cost[other][slot] += overlap_size
+            pressure[other] += overlap_size
+        for other in colleagues[course]:
+            if other != course: allowed[other].discard(slot)
+
+    for slot, course in fixed_entries:
+        if course in allowed: place(course, slot)
+
+    slot_rank = dict((s, i) for i, s in enumerate(slots))
+    unplaced = set(courses) - set(assignment)
+    while unplaced:
+        course = min(unplaced, key=lambda c:
+                     (len(allowed[c]), -pressure[c], -degree[c], c))
+        if not allowed[course]:
+            return None # -- teacher clashes or "X" marks leave no room.
+        slot = min(allowed[course],
+                   key=lambda s: (cost[course][s], slot_rank[s]))
+        place(course, slot)
+        unplaced.remove(course)
+    return assignment
+
+def order_slot_groups(assignment, slot_groups, courses):
+    """Permute an assignment within each group of interchangeable slots so
+    that it obeys the symmetry-breaking order of gen_schedules: slots are
+    filled in increasing order of their lowest course, empty slots last.
+    Only the given courses rank the slots (the model's, in gen_schedules);
+    any others just move along with their slot."""
+    course_rank = dict((c, i) for i, c in enumerate(courses))
+    ordered = dict(assignment)
+    for group in slot_groups:
+        lowest = dict((s, len(courses)) for s in group)
+        for course, slot in assignment.items():
+            if slot in lowest and course in course_rank:
+                lowest[slot] = min(lowest[slot], course_rank[course])
+        new_slot = dict(zip(sorted(group, key=lambda s: lowest[s]), group))
+        for course, slot in assignment.items():
+            if slot in new_slot:
+                ordered[course] = new_slot[slot]
+    return ordered
+
+def anneal_assignment(courses, slots, teacher_courses, overlap, start,
+                      fixed_entries=(), forbidden_entries=(), time_limit=60,
+                      seed=None, stop=None):
+    """Improve a feasible {course: slot} map by simulated annealing.
+
+    Each move either relocates one course to another slot or swaps the
+    slots of two courses. A move is scored from the overlap adjacency of
+    the courses it touches only, and moves that would break a teacher
+    clash (2), a fixed entry (4) or an "X" slot (5) are never made.
+
+    The search ends at the time limit, or earlier once stop(conflicts of
+    the best map so far), if given, returns true. Returns (best assignment, its number of conflicts, number
+    of moves)."""
+    rng = random.Random(seed)
+    course_no = dict((c, i) for i, c in enumerate(courses))
+    slot_no = dict((s, i) for i, s in enumerate(slots))
+    num_courses, num_slots = len(courses), len(slots)
+
+    neighbours = [[] for c in courses]
+    for (course1, course2), overlap_size in overlap.items():
+        if course1 in course_no and course2 in course_no:
+            neighbours[course_no[course1]].append(
+                (course_no[course2], overlap_size))
+    colleagues = [set() for c in courses]
+    for course_list in teacher_courses.values():
+        numbers = [course_no[c] for c in course_list if c in course_no]
+        for i in numbers:
+            colleagues[i].update(numbers)
+            colleagues[i].discard(i)
+
+    movable = [True] * num_courses
+    for slot, course in fixed_entries:
+        if course in course_no: movable[course_no[course]] = False
+    allowed = [[True] * num_slots for c in courses]
+    for slot, course in forbidden_entries:
+        if course in course_no: allowed[course_no[course]][slot_no[slot]] = False
+    candidates = [i for i in range(num_courses) if movable[i]]
+
+    where = [slot_no[start[c]] for c in courses]
+    def gain(i, slot, skip=-1):
+        # -- overlap between course i and its neighbours in slot (but skip).
+        total = 0
+        for j, overlap_size in neighbours[i]:
+            if where[j] == slot and j != skip: total += overlap_size
+        return total
+    def can_move(i, slot, skip=-1):
+        if not allowed[i][slot]: return False
+        for j in colleagues[i]:
+            if where[j] == slot and j != skip: return False
+        return True
+
+    current = sum([gain(i, where[i]) for i in range(num_courses)]) / 2
+    best, best_where = current, list(where)
+    if not candidates or num_slots < 2:
+        return dict(start), best, 0
+
+    # Temperatures fall geometrically from about one student's worth of
+    # conflict to almost nothing over the time limit.
+    hot, cold = 2.0, 0.05
+    started = time.time()
+    temperature, moves = hot, 0
+    time_limit = float(time_limit)
+    while True:
+        if moves % 1000 == 0:
+            elapsed = time.time() - started
+            if elapsed >= time_limit or (stop is not None and stop(best)): break
+            temperature = hot * (cold / hot) ** (elapsed / time_limit)
+        moves += 1
+
+        i = rng.choice(candidates)
+        old_slot = where[i]
+        if rng.random() < 0.5: # -- relocate course i:
+            new_slot = rng.randrange(num_slots)
+            if new_slot == old_slot or not can_move(i, new_slot): continue
+            delta = gain(i, new_slot) - gain(i, old_slot)
+            if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+                continue
+            where[i] = new_slot
+        else: # -- swap course i with course j:
+            j = rng.choice(candidates)
+            new_slot = where[j]
+            if new_slot == old_slot: continue
+            if not can_move(i, new_slot, j) or not can_move(j, old_slot, i):
+                continue
+            delta = gain(i, new_slot, j) - gain(i, old_slot, j) \
+                + gain(j, old_slot, i) - gain(j, new_slot, i)
+            if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+                continue
+            where[i], where[j] = new_slot, old_slot
+
+        current += delta
+        if current < best:
+            best, best_where = current, list(where)
+
+    assignment = dict((c, slots[best_where[i]]) for i, c in enumerate(courses))
+    return assignment, best, moves
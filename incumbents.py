@@ -0,0 +1,145 @@
+# Keeps track of the best schedule found so far while solve_schedule.py
+# runs, so that it can be saved as soon as it's found (and is still there if
+# the run is cut short), along with a trace of the conflicts over time.
+#
+# CBC, run as a command, only hands back its solution at the end; while it
+# runs, its log says when it finds a better one ("Integer solution of 18
+# found ..."), which is what the trace shows. On Ctrl-C, CBC stops and
+# writes out the best solution it has, and the run carries on from there.
+#
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from contextlib import contextmanager
+import os, re, sys, signal, tempfile, threading, time
+import multiprocessing
+
+# -- CBC log lines announcing a better integer solution:
+SOLUTION_PATTERNS = [re.compile(r"Integer solution of (-?[0-9.e+-]+) found"),
+                     re.compile(r"solution of cost (-?[0-9.e+-]+)"),
+                     re.compile(r"MIPStart provided solution with cost (-?[0-9.e+-]+)")]
+
+@contextmanager
+def replacing_file(path):
+    """Open a file that replaces path in one step when it's closed, so that
+    path always holds either the old contents or the complete new ones."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    outfile = os.fdopen(fd, "w")
+    try:
+        yield outfile
+        outfile.close()
+        os.chmod(temp_path, 0666 & ~current_umask())
+        os.rename(temp_path, path)
+    except:
+        outfile.close()
+        os.remove(temp_path)
+        raise
+
+def current_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+class Incumbents:
+    """The best schedule so far and a trace of (seconds, conflicts, source)
+    for each improvement: "greedy start", "cbc" for one announced in CBC's
+    log, "solver" for a schedule read back from the solver, and so on."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.best_saved = None # -- conflicts of the best schedule saved.
+        self.best_seen = None # -- the same, counting those in CBC's log.
+        self.trace = []
+        self.trace_file = ""
+        self.interrupted = False
+
+    def note(self, conflicts, source):
+        """Record an improvement that we have no schedule for (yet)."""
+        if self.best_seen is not None and conflicts >= self.best_seen:
+            return False
+        self.best_seen = conflicts
+        self.trace.append((round(time.time() - self.started, 3), conflicts,
+                           source))
+        if self.trace_file != "": self.write_trace(self.trace_file)
+        return True
+
+    def offer(self, conflicts, source, save):
+        """Call save() to write out a schedule with this many conflicts, if
+        it's better than the ones before it."""
+        if conflicts < 0 or \
+                (self.best_saved is not None and conflicts >= self.best_saved):
+            return False
+        self.best_saved = conflicts
+        if self.best_seen is None or conflicts < self.best_seen:
+            self.note(conflicts, source)
+        save()
+        return True
+
+    def write_trace(self, path):
+        with replacing_file(path) as outfile:
+            outfile.write("# seconds\tconflicts\tsource\n")
+            for seconds, conflicts, source in self.trace:
+                outfile.write("%.3f\t%g\t%s\n" % (seconds, conflicts, source))
+
+    @contextmanager
+    def solver_log(self, echo=True, offset=0):
+        """Send CBC's output (on our stdout) to a pseudo-terminal while it
+        runs, noting each better solution it announces, and printing it too
+        if echo is set. Use with msg=1 on the solver. (A terminal, because
+        CBC would hold back its output until the end on a pipe.) offset is
+        the constant part of the objective, which CBC doesn't see."""
+        sys.stdout.flush()
+        saved_stdout = os.dup(1)
+        master_fd, slave_fd = os.openpty()
+        os.dup2(slave_fd, 1)
+        os.close(slave_fd)
+
+        def follow():
+            log = os.fdopen(master_fd)
+            while True:
+                try:
+                    line = log.readline()
+                except IOError: # -- Linux's way of saying it's closed.
+                    break
+                if line == "": break
+                for pattern in SOLUTION_PATTERNS:
+                    match = pattern.search(line)
+                    if match is None: continue
+                    conflicts = float(match.group(1)) + offset
+                    if self.note(conflicts, "cbc") and echo:
+                        os.write(saved_stdout, "Solver found a schedule with" \
+                            " %g conflicts after %.1f seconds.\n" \
+                            % (conflicts, self.trace[-1][0]))
+                    break
+            log.close()
+        follower = threading.Thread(target=follow)
+        follower.daemon = True
+        follower.start()
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved_stdout, 1) # -- closes the terminal's last user...
+            follower.join() # -- ...so the follower gets to the end.
+            os.close(saved_stdout)
+
+    @contextmanager
+    def solver_running(self, on_interrupt=None):
+        """While the solver runs, the first Ctrl-C only sets interrupted
+        (and calls on_interrupt): the solver gets it too, and stops with
+        the best solution it has. A second Ctrl-C stops us as usual."""
+        # -- worker processes get the Ctrl-C too; one notice is enough.
+        quiet = multiprocessing.current_process().name != "MainProcess"
+        def interrupt(signum, frame):
+            if self.interrupted:
+                raise KeyboardInterrupt
+            self.interrupted = True
+            if not quiet:
+                sys.stderr.write("\nStopping with the best schedule so far" \
+                                 " (Ctrl-C again to give up).\n")
+            if on_interrupt is not None: on_interrupt()
+        previous = signal.signal(signal.SIGINT, interrupt)
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGINT, previous)
@@ -0,0 +1,88 @@
+# Caches parsed input files, so that running the tools again on the same
+# preferences and schedules skips the parsing. Each cache entry is a pickle
+# of the parsed objects, keyed by the paths, sizes and modification times
+# of the files read (and of course_selection.py, which does the parsing);
+# when any of them change, the entry no longer matches and is replaced.
+#
+# Entries live in $COURSE_SCHEDULER_CACHE, or ~/.cache/course-scheduler.
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from course_selection import Preferences, Schedule, read_combined_file, \
+    is_store
+import course_selection
+import os, hashlib, tempfile
+import cPickle as pickle
+
+enabled = True # -- the tools' --no-cache option turns this off.
+
+def cache_dir():
+    return os.environ.get("COURSE_SCHEDULER_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "course-scheduler"))
+
+def file_signature(path):
+    info = os.stat(path)
+    return (os.path.abspath(path), info.st_size, info.st_mtime)
+
+def input_signature(path):
+    """Everything about path that parsing depends on: for a directory of
+    preference files, that is every .txt file in it (editing a file in
+    place doesn't change the directory's own modification time)."""
+    if not os.path.isdir(path):
+        return [file_signature(path)]
+    signature = [file_signature(path)]
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".txt"): continue
+        info = os.stat(os.path.join(path, name))
+        signature.append((name, info.st_size, info.st_mtime))
+    return signature
+
+def cached(kind, loader, path, *args):
+    """Return loader(path, *args), from the cache if it's up to date."""
+    if not enabled:
+        return loader(path, *args)
+    try:
+        parser_source = course_selection.__file__.replace(".pyc", ".py")
+        key = (kind, args, input_signature(path), file_signature(parser_source))
+    except OSError:
+        return loader(path, *args) # -- let the loader report the problem.
+    # -- one entry per input, replaced whenever the input changes:
+    name = repr((kind, args, os.path.abspath(path)))
+    entry = os.path.join(cache_dir(), hashlib.sha1(name).hexdigest())
+
+    try:
+        entry_file = open(entry, "rb")
+        try:
+            entry_key, result = pickle.load(entry_file)
+        finally:
+            entry_file.close()
+        if entry_key == key: return result
+    except (IOError, EOFError, pickle.UnpicklingError, ValueError,
+            AttributeError, ImportError, TypeError):
+        pass # -- missing, stale or unreadable; parse the input again.
+
+    result = loader(path, *args)
+    try: # -- write to a temporary file first, so readers never see half of it.
+        if not os.path.isdir(cache_dir()): os.makedirs(cache_dir())
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir())
+        temp_file = os.fdopen(fd, "wb")
+        pickle.dump((key, result), temp_file, pickle.HIGHEST_PROTOCOL)
+        temp_file.close()
+        os.rename(temp_path, entry)
+    except (IOError, OSError):
+        pass # -- no cache then, but the result is still good.
+    return result
+
+def load_combined_file(path):
+    """Cached read_combined_file(path): (offering, preferences)."""
+    return cached("combined", read_combined_file, path)
+
+def load_preferences(datadir):
+    """Cached Preferences(datadir). Enrollment stores are opened directly;
+    mapping them is already faster than unpickling a copy."""
+    if os.path.isdir(datadir) and is_store(datadir):
+        return Preferences(datadir)
+    return cached("datadir", Preferences, datadir)
+
+def load_schedule(path, lenient=False):
+    """Cached Schedule(path, lenient)."""
+    return cached("schedule", Schedule, path, lenient)
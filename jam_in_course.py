@@ -10,62 +10,114 @@
 from course_selection import Preferences, Schedule, read_combined_file
 from check_schedule import format_list
 from optparse import OptionParser
+import input_cache
 
 def read_classlist(path):
     # TODOXXX should also consider comma separation on each line
     # TODOXXX should also consider comments
     input_file = open(path, "r")
-    return [line.strip() for line in input_file]
+    return [line.strip() for line in input_file if line.strip() != ""]
+
+def members(mask, students):
+    """The students whose bits are set in mask, in class list order."""
+    return [s for i, s in enumerate(students) if mask >> i & 1]
+
+def classlist_masks(preferences, students):
+    """An inverted index for one class list: masks[course] has bit i set
+    when the i-th student on the list takes the course. Built from each
+    student's row of the enrollment arrays, so it takes time in proportion
+    to the class list, not to everyone's preferences."""
+    indptr, indices = preferences.enrollments()
+    person_ids, courses = preferences.person_table.ids, preferences.course_table.names
+    masks = {}
+    for i, student in enumerate(students):
+        person = person_ids.get(student)
+        if person is None: continue # -- nothing requested, so never in the way.
+        for course in indices[indptr[person]:indptr[person+1]].tolist():
+            masks[courses[course]] = masks.get(courses[course], 0) | (1 << i)
+    return masks
+
+def print_jam_report(schedule, students, masks):
+    """Print the conflicts in each slot; returns [(slot, number of students
+    who could be put in a section there)]."""
+    everyone = (1 << len(students)) - 1
+    fits = []
+    for slot in schedule.slotlist:
+        print "" # -- extra newline acts as separator
+        print "Conflicts in slot " + slot
+        taken = 0
+        for teacher, course_name in schedule.timeslots.get(slot, {}).items():
+            mask = masks.get(course_name, 0)
+            if mask != 0:
+                conflicts = members(mask, students)
+                print "\t%d students take %s: %s" \
+                    % (len(conflicts), course_name, format_list(conflicts))
+            taken |= mask
+
+        remaining = members(everyone & ~taken, students)
+        print "-- can put %d people in a section at this timeslot: %s" \
+            % (len(remaining), format_list(remaining))
+        fits.append((slot, len(remaining)))
+    return fits
+
+def print_summary(schedule, results):
+    """One line per class list, with its best slot (the first of the slots
+    that fit the most students), sorted by that slot: class lists that
+    would compete for a slot end up next to each other."""
+    rank = dict((s, i) for i, s in enumerate(schedule.slotlist))
+    rows = []
+    for path, students, fits in results:
+        if not fits: continue
+        most = max([fit for slot, fit in fits])
+        best = [slot for slot, fit in fits if fit == most][0]
+        rows.append((rank[best], -most, path, best, most, len(students)))
+    rows.sort()
+
+    print ""
+    print "Summary, by best slot:"
+    print "%-12s  %9s  %8s  %s" % ("Best slot", "Can place", "Students", "Class list")
+    for _rank, _most, path, best, most, size in rows:
+        print "%-12s  %9d  %8d  %s" % (best, most, size, path)
 
 if __name__=="__main__":
     # TODOXXX add -o option?
-    usage = "%prog <classlist> <preferences> <schedule>\n%prog -p <preference file> <classlist> <schedule>"
+    usage = "%prog <preferences> <classlist>... <schedule>\n%prog -p <preference file> <classlist>... <schedule>"
     parser = OptionParser(usage=usage)
     parser.add_option('-p', '--preferences', dest="preference_file", default="",
                       help="obtain student preferences from single file")
+    parser.add_option('--no-cache', dest="cache", action="store_false",
+                      default=True, help="always re-read the input files")
     (opts, args) = parser.parse_args()
+    input_cache.enabled = opts.cache
 
     if opts.preference_file != "":
-        if len(args) != 2:
-            parser.error("two arguments required with option '-p': class list, and schedule")
-        classlist_file = args[0]
-        selection_file = args[1]
-        students = read_classlist(classlist_file)
-        offering, preferences = read_combined_file(opts.preference_file)
-        schedule = Schedule(selection_file, True)
+        if len(args) < 2:
+            parser.error("at least two arguments required with option '-p': class list(s), and schedule")
+        classlist_files = args[:-1]
+        selection_file = args[-1]
+        offering, preferences = input_cache.load_combined_file(opts.preference_file)
     else:
-        if len(args) != 3:
-            parser.error("three arguments required: student preferences, class list, and schedule")
+        if len(args) < 3:
+            parser.error("at least three arguments required: student preferences, class list(s), and schedule")
         data_dir = args[0]
-        classlist_file = args[1]
-        selection_file = args[2]
+        classlist_files = args[1:-1]
+        selection_file = args[-1]
+        preferences = input_cache.load_preferences(data_dir)
+    schedule = input_cache.load_schedule(selection_file, True)
+
+    results = []
+    for classlist_file in classlist_files:
         students = read_classlist(classlist_file)
-        preferences, schedule = Preferences(data_dir), Schedule(selection_file, True)
+        if len(classlist_files) > 1:
+            if results: print ""
+            print "==== %s ====" % classlist_file
 
-    # Print initial classlist:
-    print "Total %d students in class: %s" % (len(students), format_list(students))
+        # Print initial classlist:
+        print "Total %d students in class: %s" % (len(students), format_list(students))
 
-    # Iterate through slots and show conflicts wrt classlist:
-    for slot in schedule.slotlist:
-        print "" # -- extra newline acts as separator
-        print "Conflicts in slot " + slot
-        seen_students = set()
-        for teacher in schedule.timeslots[slot]:
-            course_name = schedule.timeslots[slot][teacher]
-            conflicts = []
-            for student in students:
-                for other_course, _comment in preferences.people[student]:
-                    if course_name == other_course:
-                        conflicts.append(student)
-                        seen_students.add(student)
-                        break
-            if len(conflicts) != 0:
-                print "\t%d students take %s: %s" \
-                    % (len(conflicts), course_name, format_list(conflicts))
+        # Iterate through slots and show conflicts wrt classlist:
+        masks = classlist_masks(preferences, students)
+        fits = print_jam_report(schedule, students, masks)
+        results.append((classlist_file, students, fits))
 
-        remaining = []
-        for student in students:
-            if student not in seen_students:
-                remaining.append(student)
-        print "-- can put %d people in a section at this timeslot: %s" \
-            % (len(remaining), format_list(remaining))
+    print_summary(schedule, results)
@@ -0,0 +1,94 @@
+# A quick lower bound on the number of conflicts in any schedule, so that
+# solve_schedule.py can tell how far a schedule is from the best possible,
+# and stop looking once it's close enough.
+#
+# Each pair of courses sharing students is counted at most once, by one of:
+# two fixed courses in the same slot; a clique of courses all sharing
+# students with each other, which can't all get a slot of their own if they
+# outnumber the slots; or a course and the fixed courses in the slots it
+# may go in. (Courses of the same teacher never share a slot, so their
+# pairs don't count towards a clique's unavoidable conflicts.)
+#
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from course_selection import pairs_in_slot
+
+def forced_pairs(num_courses, num_slots):
+    """The fewest pairs of courses sharing a slot when num_courses go in
+    num_slots slots, i.e. with the courses spread out evenly."""
+    per_slot, extra = divmod(num_courses, num_slots)
+    return extra * pairs_in_slot(per_slot + 1) \
+        + (num_slots - extra) * pairs_in_slot(per_slot)
+
+def conflict_lower_bound(courses, teacher_courses, overlap, allowed, fixed):
+    """A lower bound on the conflicts of any schedule of courses, given the
+    (ordered-pair) overlap table from gen_schedules, the slots each course
+    may go in ({course: [slots]}) and the courses already placed ({course:
+    slot}; see presolve.py). Returns (bound, parts) with the bound split up
+    as {"fixed": ..., "fixed neighbours": ..., "cliques": ...}, and the
+    number of cliques used as parts["num_cliques"]."""
+    teachers_of = {}
+    for teacher, course_list in teacher_courses.items():
+        for course in course_list:
+            teachers_of.setdefault(course, set()).add(teacher)
+    def slots_of(course):
+        if course in fixed: return [fixed[course]]
+        return allowed.get(course, [])
+    course_set = set(courses)
+    weight = {} # -- weight[course] == {other course: students in both}
+    for (course1, course2), overlap_size in overlap.items():
+        if course1 in course_set and course2 in course_set:
+            weight.setdefault(course1, {})[course2] = overlap_size
+    parts = {"fixed": 0, "fixed neighbours": 0, "cliques": 0, "num_cliques": 0}
+
+    # Fixed courses in the same slot conflict for sure:
+    for course1, others in weight.items():
+        for course2, overlap_size in others.items():
+            if course1 < course2 and course1 in fixed and course2 in fixed \
+                    and fixed[course1] == fixed[course2]:
+                parts["fixed"] += overlap_size
+
+    # Cliques of courses, grown greedily from the heaviest pairs; the pairs
+    # of a clique that counts aren't used again. Two fixed courses in
+    # different slots never share one, so they fit in a clique regardless.
+    unused = dict((c, dict((d, w) for d, w in weight.get(c, {}).items() \
+                           if not (c in fixed and d in fixed))) for c in courses)
+    for course1 in fixed:
+        for course2 in fixed:
+            if fixed[course1] != fixed[course2]: unused[course1][course2] = 0
+    def sharable(course1, course2): # -- whether the two can share a slot.
+        if course1 in fixed and course2 in fixed: return False
+        return not teachers_of.get(course1, set()) & \
+            teachers_of.get(course2, set())
+    pairs = sorted([(-w, c, d) for c in courses for d, w in unused[c].items() \
+                    if c < d and w > 0])
+    for _w, course1, course2 in pairs:
+        if course2 not in unused[course1]: continue # -- in a clique already.
+        clique = [course1, course2]
+        candidates = set(unused[course1]) & set(unused[course2])
+        while candidates:
+            best = max(candidates, key=lambda c: \
+                       (sum([unused[c][m] for m in clique]), c))
+            clique.append(best)
+            candidates &= set(unused[best])
+        num_slots = len(set([s for c in clique for s in slots_of(c)]))
+        if len(clique) <= num_slots: continue
+        weights = sorted([unused[c][d] for i, c in enumerate(clique) \
+                          for d in clique[i+1:] if sharable(c, d)])
+        parts["cliques"] += sum(weights[:forced_pairs(len(clique), num_slots)])
+        parts["num_cliques"] += 1
+        for i, c in enumerate(clique):
+            for d in clique[i+1:]:
+                if sharable(c, d): del unused[c][d], unused[d][c]
+
+    # Any other course conflicts with the fixed courses in whichever of its
+    # slots it goes in, so at least with those in the best of its slots:
+    for course in [c for c in courses if c not in fixed]:
+        in_slot = dict((s, 0) for s in slots_of(course))
+        for other, overlap_size in unused[course].items():
+            if other in fixed and fixed[other] in in_slot:
+                in_slot[fixed[other]] += overlap_size
+        if in_slot: parts["fixed neighbours"] += min(in_slot.values())
+
+    bound = parts["fixed"] + parts["fixed neighbours"] + parts["cliques"]
+    return bound, parts
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# Converts preferences from the text formats into enrollment stores (see
+# course_selection.py), which the other programs accept in place of a
+# directory of preference files and open as memory maps:
+#
+#   ./make_store.py -p preferences.txt school
+#   ./solve_schedule.py school/students.store school/teachers.store template.txt
+#
+#   ./make_store.py sample_students students.store
+#
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from course_selection import Preferences, read_combined_file
+from optparse import OptionParser
+import os, time
+
+def store_size(path):
+    return sum([os.path.getsize(os.path.join(path, name)) \
+                for name in os.listdir(path)])
+
+def report(preferences, path):
+    indptr, indices = preferences.enrollments()
+    print "Wrote %s: %d people, %d courses, %d enrollments, %d kB." \
+        % (path, len(preferences.person_table), len(preferences.course_table),
+           len(indices), store_size(path) // 1024)
+
+if __name__=="__main__":
+    usage = "%prog [options] <datadir> <store>\n%prog [options] -p <preference file> <output directory>"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-p', '--preference-file', dest="combined",
+                      action="store_true", default=False,
+                      help="read a combined preference file, and write students.store and teachers.store in the output directory")
+    (opts, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("two arguments required")
+
+    started = time.time()
+    if opts.combined:
+        offering, preferences = read_combined_file(args[0])
+        stores = [(preferences, os.path.join(args[1], "students.store")),
+                  (offering, os.path.join(args[1], "teachers.store"))]
+    else:
+        stores = [(Preferences(args[0]), args[1])]
+    for preferences, path in stores:
+        preferences.write_store(path)
+        report(preferences, path)
+    print "(%.2f seconds)" % (time.time() - started)
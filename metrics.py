@@ -0,0 +1,57 @@
+# Per-phase instrumentation for the scheduler: wall time, peak memory and
+# model sizes for each phase of a run, written out as JSON.
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+import json, resource, time
+from contextlib import contextmanager
+
+def peak_memory_kb(who=resource.RUSAGE_SELF):
+    """Peak resident set size so far, in kilobytes (as Linux reports it)."""
+    return resource.getrusage(who).ru_maxrss
+
+class Metrics:
+    """A list of phase records, in the order the phases finished.
+
+    Each record is a dict with the phase name, its wall time in seconds,
+    the peak memory of this process and of its finished children (i.e. an
+    external solver) by the end of the phase, plus whatever counts the code
+    running the phase stores in it ("variables", "constraints", ...)."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name, **counts):
+        record = {"phase": name}
+        record.update(counts)
+        started = time.time()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.time() - started, 6)
+            record["peak_memory_kb"] = peak_memory_kb()
+            record["peak_child_memory_kb"] = \
+                peak_memory_kb(resource.RUSAGE_CHILDREN)
+            self.phases.append(record)
+
+    def totals(self):
+        """Time and model sizes summed over all phases."""
+        totals = {}
+        for record in self.phases:
+            for key in ["seconds", "variables", "constraints", "nonzeros"]:
+                if key in record:
+                    totals[key] = totals.get(key, 0) + record[key]
+        return totals
+
+    def write_json(self, filename):
+        report = {"wall_seconds": round(time.time() - self.started, 6),
+                  "peak_memory_kb": peak_memory_kb(),
+                  "peak_child_memory_kb":
+                      peak_memory_kb(resource.RUSAGE_CHILDREN),
+                  "totals": self.totals(),
+                  "phases": self.phases}
+        outfile = open(filename, "w")
+        json.dump(report, outfile, indent=2, sort_keys=True)
+        outfile.write("\n")
+        outfile.close()
@@ -0,0 +1,172 @@
+# Builds the scheduling ILP directly as a sparse constraint matrix and
+# solves it in-process with HiGHS (via scipy.optimize.milp), skipping the
+# PuLP expression building and the LP/MPS file that COIN_CMD has to write.
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+import numpy, time
+
+def milp_available():
+    """Whether scipy.optimize.milp (SciPy 1.9 or newer) can be imported.
+    SciPy 1.9 needs Python 3.8, so not on the Python 2 this program runs
+    on; solve_schedule.py checks this before taking '-b highs'."""
+    try:
+        from scipy.optimize import milp
+    except ImportError:
+        return False
+    return True
+
+class MatrixModel:
+    """An ILP kept as column bounds, costs and a COO constraint matrix."""
+
+    def __init__(self):
+        self.costs, self.lower, self.upper, self.integral = [], [], [], []
+        self.rows, self.cols, self.vals = [], [], [] # -- COO triplets.
+        self.row_lower, self.row_upper = [], []
+
+    def add_columns(self, count, lower=0, upper=1, integral=True):
+        first = len(self.costs)
+        self.costs.extend([0.0] * count)
+        self.lower.extend([lower] * count)
+        self.upper.extend([upper] * count)
+        self.integral.extend([1 if integral else 0] * count)
+        return first
+
+    def add_row(self, cols, vals, lower, upper):
+        row = len(self.row_lower)
+        self.rows.extend([row] * len(cols))
+        self.cols.extend(cols)
+        self.vals.extend(vals)
+        self.row_lower.append(lower)
+        self.row_upper.append(upper)
+        return row
+
+    def num_columns(self): return len(self.costs)
+    def num_rows(self): return len(self.row_lower)
+    def num_nonzeros(self): return len(self.vals)
+
+    def solve(self, time_limit=None):
+        """Returns (x, objective, optimal); x is None if nothing was found."""
+        try:
+            from scipy.optimize import milp, LinearConstraint, Bounds
+            from scipy.sparse import coo_matrix
+        except ImportError:
+            raise ImportError("the 'highs' backend needs SciPy 1.9 or newer"
+                              " (scipy.optimize.milp)")
+
+        matrix = coo_matrix((self.vals, (self.rows, self.cols)),
+                            shape=(self.num_rows(), self.num_columns()))
+        constraints = []
+        if self.num_rows() > 0:
+            constraints.append(LinearConstraint(matrix.tocsr(),
+                                                self.row_lower, self.row_upper))
+        options = {}
+        if time_limit is not None:
+            options["time_limit"] = time_limit
+        result = milp(numpy.array(self.costs), constraints=constraints,
+                      integrality=numpy.array(self.integral),
+                      bounds=Bounds(self.lower, self.upper), options=options)
+        if result.x is None:
+            return None, None, False
+        return result.x, result.fun, result.status == 0
+
+def solve_matrix_model(courses, slots, teacher_courses, conflict_pairs,
+                       conflict_weight, fixed_entries, forbidden_entries,
+                       slot_groups, time_limit=None, num_solutions=1,
+                       tolerance=0, record=None):
+    """Same model as the PuLP one in gen_schedules, numbered as a matrix.
+
+    Returns a list of up to num_solutions distinct solutions, best first,
+    each as ({course: slot}, objective value, whether it's proven optimal).
+    After each solve the solution found is cut off with a no-good row and
+    the same matrix is solved again, as long as the objective stays within
+    tolerance of the best one. If a record dict is given, the model sizes
+    and the time spent building the matrix are stored in it."""
+    started = time.time()
+    model = MatrixModel()
+    course_no = dict((c, j) for j, c in enumerate(courses))
+    slot_no = dict((s, i) for i, s in enumerate(slots))
+
+    # scheduled[slot, course] == 1 : course scheduled in slot.
+    first = model.add_columns(len(slots) * len(courses))
+    def scheduled(s, c): return first + slot_no[s]*len(courses) + course_no[c]
+
+    # conflict[course1, course2] == 1 : courses in same slot.
+    first_conflict = model.add_columns(len(conflict_pairs))
+    conflict = dict((pair, first_conflict + k) \
+                    for k, pair in enumerate(conflict_pairs))
+    for pair, weight in conflict_weight.items():
+        model.costs[conflict[pair]] = weight
+
+    # (1) every course is scheduled in exactly one slot
+    for course in courses:
+        model.add_row([scheduled(s, course) for s in slots],
+                      [1] * len(slots), 1, 1)
+
+    # (2) absolutely no course conflicts for the teachers
+    for teacher_course_list in teacher_courses.values():
+        for slot in slots:
+            cols = [scheduled(slot, c) for c in teacher_course_list]
+            model.add_row(cols, [1] * len(cols), -numpy.inf, 1)
+
+    # (3) our conflict table contains correct values
+    for course1, course2 in conflict_pairs:
+        if (course1, course2) not in conflict_weight: continue
+        for slot in slots:
+            model.add_row([scheduled(slot, course1), scheduled(slot, course2),
+                           conflict[course1, course2]], [1, 1, -1],
+                          -numpy.inf, 1)
+
+    # (4) and (5) pin entries through the column bounds:
+    for slot, course in fixed_entries:
+        model.lower[scheduled(slot, course)] = 1
+    for slot, course in forbidden_entries:
+        model.upper[scheduled(slot, course)] = 0
+
+    # (6) interchangeable slots are used in order of their lowest course;
+    # seen[slot, i] bounds how many of the first i courses are in the slot.
+    for group in slot_groups:
+        for prev_slot, slot in zip(group[:-1], group[1:]):
+            model.upper[scheduled(slot, courses[0])] = 0
+            prev_seen = [scheduled(prev_slot, courses[0])]
+            for i in range(1, len(courses)):
+                seen = model.add_columns(1, 0, numpy.inf, False)
+                model.add_row([seen] + prev_seen, [1] + [-1] * len(prev_seen),
+                              -numpy.inf, 0)
+                model.add_row([scheduled(slot, courses[i]), seen], [1, -1],
+                              -numpy.inf, 0)
+                prev_seen = [seen, scheduled(prev_slot, courses[i])]
+
+    print("Built a %d x %d constraint matrix with %d nonzeros." \
+          % (model.num_rows(), model.num_columns(), model.num_nonzeros()))
+    if record is not None:
+        record["variables"] = model.num_columns()
+        record["constraints"] = model.num_rows()
+        record["nonzeros"] = model.num_nonzeros()
+        record["build_seconds"] = round(time.time() - started, 6)
+
+    solutions = []
+    fixed_courses = set([c for _s, c in fixed_entries])
+    free_courses = [c for c in courses if c not in fixed_courses]
+    while True:
+        x, objective, optimal = model.solve(time_limit)
+        if x is None: break
+        if solutions and objective > solutions[0][1] + tolerance + 1e-6: break
+        assignment = {}
+        for slot in slots:
+            for course in courses:
+                if x[scheduled(slot, course)] > 0.5:
+                    assignment[course] = slot
+        solutions.append((assignment, objective, optimal,))
+        if len(solutions) >= num_solutions or not free_courses: break
+
+        if len(solutions) == 1: # -- near-optimal solutions only:
+            costed = [j for j, cost in enumerate(model.costs) if cost != 0]
+            model.add_row(costed, [model.costs[j] for j in costed],
+                          -numpy.inf, objective + tolerance)
+        model.add_row([scheduled(assignment[c], c) for c in free_courses],
+                      [1] * len(free_courses), -numpy.inf,
+                      len(free_courses) - 1)
+
+    if not solutions:
+        solutions.append(({}, -1, False,)) # -- -1 as in format_schedules_html.
+    return solutions
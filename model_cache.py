@@ -0,0 +1,112 @@
+# Caches the ILP models built by solve_schedule.py, so that solving the same
+# problem again (with a longer -t, say) skips building the model with PuLP
+# and goes straight to the solver. Each entry is a directory named by a hash
+# of everything the model is built from, holding the MPS file CBC reads and
+# an index of its columns. Entries not used for the longest time are
+# removed once the cache outgrows max_bytes.
+#
+# Entries live in the "models" directory of the input cache (input_cache.py).
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+import input_cache
+import os, json, shutil, hashlib, tempfile
+
+enabled = True # -- solve_schedule.py's --no-model-cache turns this off.
+max_bytes = 1024 * 1024 * 1024 # -- and --model-cache-mb sets this.
+
+MODEL_FILE = "model.mps"
+INDEX_FILE = "index.json"
+
+def models_dir():
+    return os.path.join(input_cache.cache_dir(), "models")
+
+def model_key(builder_path, *parts):
+    """The name of the entry for a model built by the code in builder_path
+    from parts (which should have a stable repr, i.e. no sets or dicts)."""
+    try:
+        builder = input_cache.file_signature(builder_path.replace(".pyc", ".py"))
+    except OSError:
+        builder = builder_path
+    return hashlib.sha1(repr((builder,) + parts)).hexdigest()
+
+class CachedModel:
+    """An entry: the path of its MPS file, the MPS column of each variable
+    (by key, e.g. ("scheduled", slot, course)) and the model's size."""
+
+    def __init__(self, path):
+        self.path = path
+        self.model_path = os.path.join(path, MODEL_FILE)
+        index = json.load(open(os.path.join(path, INDEX_FILE)))
+        # -- names are byte strings; latin-1 carries any bytes through JSON.
+        def unpack(part):
+            if isinstance(part, unicode): return part.encode("latin-1")
+            return part
+        self.columns = dict((tuple([unpack(part) for part in key]), column) \
+                            for key, column in index["columns"])
+        self.num_variables = index["variables"]
+        self.num_constraints = index["constraints"]
+
+def lookup(key):
+    """The CachedModel for key, or None if there isn't one."""
+    path = os.path.join(models_dir(), key)
+    try:
+        entry = CachedModel(path)
+    except (IOError, OSError, ValueError, KeyError):
+        return None # -- missing or unreadable; the model gets built again.
+    try:
+        os.utime(path, None) # -- most recently used, as far as evict goes.
+    except OSError:
+        pass
+    return entry
+
+def store(key, prob, variable_of):
+    """Write prob to the cache under key, given a {key: LpVariable} map of
+    its variables. Returns the new CachedModel, or None if it couldn't be
+    written (e.g. no space left), in which case prob is solved as usual."""
+    path = os.path.join(models_dir(), key)
+    try:
+        if not os.path.isdir(models_dir()): os.makedirs(models_dir())
+        # -- written next to the entry and renamed into place when complete:
+        temp_path = tempfile.mkdtemp(dir=models_dir(), prefix=".tmp-")
+        try:
+            _vs, variable_names, _constraint_names, _objective_name = \
+                prob.writeMPS(os.path.join(temp_path, MODEL_FILE), rename=1)
+            columns = [[list(k), variable_names[v.name]] \
+                       for k, v in variable_of.items() if v.name in variable_names]
+            index_file = open(os.path.join(temp_path, INDEX_FILE), "w")
+            json.dump({"columns": columns, "variables": len(variable_names),
+                       "constraints": len(prob.constraints)},
+                      index_file, encoding="latin-1")
+            index_file.close()
+            if lookup(key) is not None: # -- another run got there first.
+                return lookup(key)
+            if os.path.isdir(path): shutil.rmtree(path) # -- unreadable.
+            os.rename(temp_path, path)
+        finally:
+            if os.path.isdir(temp_path): shutil.rmtree(temp_path)
+    except (IOError, OSError):
+        return None
+    evict(keep=key)
+    return lookup(key)
+
+def entry_size(path):
+    return sum([os.path.getsize(os.path.join(path, name)) \
+                for name in os.listdir(path)])
+
+def evict(keep=None):
+    """Remove the least recently used entries (other than keep) until the
+    cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(models_dir()):
+        path = os.path.join(models_dir(), name)
+        if name.startswith(".") or not os.path.isdir(path): continue
+        try:
+            entries.append((os.path.getmtime(path), entry_size(path), name))
+        except OSError:
+            pass # -- removed by another run meanwhile.
+    total = sum([size for _mtime, size, _name in entries])
+    for _mtime, size, name in sorted(entries):
+        if total <= max_bytes: break
+        if name == keep: continue
+        shutil.rmtree(os.path.join(models_dir(), name), ignore_errors=True)
+        total -= size
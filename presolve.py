@@ -0,0 +1,109 @@
+# Shrinks the scheduling ILP before it's built: courses fixed by the
+# template and the slots teachers marked "X" become constants rather than
+# variables pinned by rows (4) and (5), and courses that share no students
+# with any other course are left out of the model and placed afterwards,
+# since they can't cause conflicts wherever they go.
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+class Presolved:
+    """The result of presolve.
+
+    courses: the courses left in the model, in the order given.
+    allowed: {course: [slots]} for those courses, the slots it may go in.
+    fixed: {course: slot} for the courses the template places.
+    set_aside: the courses left out, to be placed by complete().
+    infeasible: [(course, reason)] for courses with nowhere to go."""
+
+    def __init__(self):
+        self.courses, self.allowed, self.fixed = [], {}, {}
+        self.set_aside, self.infeasible = [], []
+        self.teachers_of = {}
+        self.slots = []
+
+    def complete(self, assignment):
+        """Add the fixed and set-aside courses to a {course: slot} map of
+        the model's courses; each set-aside course goes in the first of its
+        allowed slots that none of its teachers is busy in."""
+        full = dict(assignment)
+        full.update(self.fixed)
+        busy = {}
+        for course, slot in full.items():
+            for teacher in self.teachers_of.get(course, ()):
+                busy.setdefault(teacher, set()).add(slot)
+        for course in self.set_aside:
+            for slot in self.allowed[course]:
+                teachers = self.teachers_of.get(course, ())
+                if not [t for t in teachers if slot in busy.get(t, ())]:
+                    full[course] = slot
+                    for teacher in teachers:
+                        busy.setdefault(teacher, set()).add(slot)
+                    break
+        return full
+
+    def num_variables(self):
+        return sum([len(self.allowed[c]) for c in self.courses])
+
+def presolve(courses, slots, teacher_courses, overlap, fixed_entries,
+             forbidden_entries):
+    """Work out which scheduled[slot, course] variables the model needs.
+
+    A fixed course rules its slot out for its teachers' other courses, and
+    a course left with a single slot is fixed in turn. A course sharing no
+    students with any other is set aside when its teachers have more
+    allowed slots for it than other courses to place, so that complete()
+    always finds it a slot."""
+    result = Presolved()
+    result.slots = list(slots)
+    for teacher, course_list in teacher_courses.items():
+        for course in course_list:
+            result.teachers_of.setdefault(course, []).append(teacher)
+    def mates(course): # -- courses sharing a teacher with course.
+        return set([c for t in result.teachers_of.get(course, ()) \
+                    for c in teacher_courses[t] if c != course])
+
+    forbidden = set(forbidden_entries)
+    allowed = dict((c, [s for s in slots if (s, c) not in forbidden]) \
+                   for c in courses)
+    fixed_slots = {}
+    for slot, course in fixed_entries:
+        if course not in allowed: continue # -- nobody offers it: ignored.
+        fixed_slots.setdefault(course, []).append(slot)
+
+    # Fix courses, ruling their slots out for their teachers' other courses
+    # (which may leave those with a single slot, fixing them too):
+    pending = [(c, s[0]) for c, s in sorted(fixed_slots.items()) if len(s) == 1]
+    for course, slots_given in sorted(fixed_slots.items()):
+        if len(slots_given) > 1:
+            result.infeasible.append((course, "placed in %d slots by the" \
+                " template" % len(slots_given)))
+    pending += [(c, allowed[c][0]) for c in courses \
+                if c not in fixed_slots and len(allowed[c]) == 1]
+    while pending:
+        course, slot = pending.pop(0)
+        if course in result.fixed: continue
+        if slot not in allowed[course]: # -- "X" or a teacher clash.
+            if course in fixed_slots:
+                result.infeasible.append((course, "the template puts it in" \
+                                          " %s, which is ruled out" % slot))
+            continue # -- (otherwise it's found to have no slot below.)
+        result.fixed[course] = slot
+        for mate in mates(course):
+            if mate in result.fixed or slot not in allowed[mate]: continue
+            allowed[mate] = [s for s in allowed[mate] if s != slot]
+            if len(allowed[mate]) == 1 and mate not in fixed_slots:
+                pending.append((mate, allowed[mate][0]))
+
+    linked = set([c1 for c1, _c2 in overlap.keys()])
+    for course in courses:
+        if course in result.fixed or course in fixed_slots: continue
+        if not allowed[course]:
+            result.infeasible.append((course, "no slot its teachers can" \
+                                              " take it in"))
+            continue
+        result.allowed[course] = allowed[course]
+        num_mates = len([m for m in mates(course) if m not in result.fixed])
+        if course not in linked and len(allowed[course]) > num_mates:
+            result.set_aside.append(course)
+        else:
+            result.courses.append(course)
+    return result
@@ -4,13 +4,30 @@
 
 from course_selection import Preferences, Schedule, read_combined_file
 from check_schedule import print_conflict_report, print_student_report
+from milp_backend import solve_matrix_model, milp_available
+from heuristics import dsatur_assignment, order_slot_groups, \
+  count_assignment_conflicts, anneal_assignment
+from presolve import presolve
+from lower_bound import conflict_lower_bound
 
 from pulp import *
-from progressbar import ProgressBar
+from metrics import Metrics
+from incumbents import Incumbents, replacing_file
+import input_cache, model_cache
 
 from optparse import OptionParser
-import sys
+import sys, os
 import string
+import tempfile
+import subprocess
+import copy
+import multiprocessing, Queue
+import signal
+import time
+import cProfile
+
+metrics = Metrics() # -- per-phase timings and model sizes, see --metrics.
+incumbents = Incumbents() # -- the best schedule so far, see --trace.
 
 # Helper function that isn't in Python, but should have been:
 
@@ -28,13 +45,26 @@ def flatten(l):
 # Actual logic relating to schedule generation:
 
 def format_schedules_html(offering, schedule, num_conflicts, preferences, opts, consolidate=True):
-	slotlist = schedule.slotlist
 	if num_conflicts < 0: # The caller might not know this...
 		header = "Results of Course Scheduling"
 	else:
 		header = "Results of Course Scheduling, %d Conflict%s" \
 	        % (num_conflicts, "" if num_conflicts == 1 else "s")
 
+	print_html_header(header)
+	format_schedule_table_html(offering, schedule, consolidate)
+	print_html_footer()
+
+def format_solutions_html(offering, solutions, preferences, opts, consolidate=True):
+	header = "Results of Course Scheduling, %d Alternatives" % len(solutions)
+	print_html_header(header)
+	for i, (schedule, num_conflicts) in enumerate(solutions):
+		print "<h2>Solution #%d, %d Conflict%s</h2>" \
+		    % (i + 1, num_conflicts, "" if num_conflicts == 1 else "s")
+		format_schedule_table_html(offering, schedule, consolidate)
+	print_html_footer()
+
+def print_html_header(header):
 	print "<html>"
 	print "<head>"
 	print "<title>" + header + "</title>"
@@ -42,6 +72,13 @@ def format_schedules_html(offering, schedule, num_conflicts, preferences, opts,
 	print "</head>"
 	print "<body>"
 	print "<h1>" + header + "</h1>"
+
+def print_html_footer():
+	print "</body>"
+	print "</html>"
+
+def format_schedule_table_html(offering, schedule, consolidate=True):
+	slotlist = schedule.slotlist
 	print "<table>"
 
 	# Consolidate columns where teacher only teaches one course:
@@ -90,10 +127,8 @@ def format_schedules_html(offering, schedule, num_conflicts, preferences, opts,
 		print "  </tr>"
 
 	print "</table>"
-	print "</body>"
-	print "</html>"
 
-def format_schedules(offering, schedule, num_conflicts, slotlist, preferences, opts):
+def format_schedules(offering, schedule, num_conflicts, slotlist, preferences, opts, number=None):
     slotlist = schedule.slotlist
     
     # Print solution header:
@@ -101,7 +136,10 @@ def format_schedules(offering, schedule, num_conflicts, slotlist, preferences, o
         cfl_str = "conflict"
     else:
         cfl_str = "conflicts"
-    print "Solution, %d %s:" % (num_conflicts, cfl_str)
+    if number is None:
+        print "Solution, %d %s:" % (num_conflicts, cfl_str)
+    else:
+        print "Solution #%d, %d %s:" % (number, num_conflicts, cfl_str)
     print "===" # marker for check_schedule.py
 
     # Print the schedule - determine column widths and format a table:
@@ -143,49 +181,703 @@ def format_schedules(offering, schedule, num_conflicts, slotlist, preferences, o
         else:
             print_conflict_report(preferences, schedule)
 
+def write_mip_start(outfile, columns, start_values):
+  """Write (key, value) pairs in the solution format CBC reads back with its
+  'mips' command. CBC gets an MPS file with normalised names, so each value
+  is written under the name columns gives its key."""
+  outfile.write("Stopped on iterations - objective value 0\n")
+  for i, (key, start_value) in enumerate(start_values):
+    if key not in columns: continue # -- unused variable.
+    outfile.write("%d %s %d 0\n" % (i, columns[key], start_value))
+  outfile.close()
+
+def run_cbc(model_path, options, columns, msg=False):
+  """Run CBC on an MPS file (e.g. a cached model, see model_cache.py) the
+  way COIN_CMD would. Returns (PuLP status, {key: value}) for the variables
+  in columns, a {key: MPS column name} map."""
+  solver = solvers.COIN_CMD()
+  solution_fd, solution_path = tempfile.mkstemp(suffix="-pulp.sol")
+  os.close(solution_fd)
+  output = None if msg else open(os.devnull, "w")
+  try:
+    args = [solver.path, model_path] + options \
+        + ["branch", "printingOptions", "all", "solution", solution_path]
+    if subprocess.Popen(args, stdout=output, stderr=output).wait() != 0 \
+        or os.path.getsize(solution_path) == 0:
+      raise PulpSolverError("Pulp: Error while executing " + solver.path)
+    status, values, _costs, _prices, _slacks = solver.readsol_MPS(
+        solution_path, None, [], columns, {}, "OBJ")
+  finally:
+    if output is not None: output.close()
+    os.remove(solution_path)
+  return status, values
+
+def run_solver(solve, follow_log=False, offset=0):
+  """Return solve(), which runs CBC, so that Ctrl-C stops CBC rather than
+  us; with follow_log, CBC's log is followed too (see incumbents.py), its
+  objective values counted from offset."""
+  with incumbents.solver_running():
+    if follow_log:
+      with incumbents.solver_log(offset=offset):
+        return solve()
+    return solve()
+
+def interchangeable_slots(schedule):
+  """Group the slots that can be permuted freely in any solution.
+
+  A slot qualifies when the template fixes no course in it; slots with the
+  same set of teachers marked "X" are interchangeable with each other.
+  Only groups of two or more slots are returned, each in slotlist order."""
+  away_teachers = {}
+  for teacher, items in schedule.bad_slots.items():
+    for slot in items:
+      away_teachers.setdefault(slot, set()).add(teacher)
+
+  groups, group_order = {}, []
+  for slot in schedule.slotlist:
+    if slot in schedule.timeslots: continue # -- has fixed entries.
+    key = frozenset(away_teachers.get(slot, ()))
+    if key not in groups:
+      groups[key] = []
+      group_order.append(key)
+    groups[key].append(slot)
+  return [groups[key] for key in group_order if len(groups[key]) > 1]
+
+def format_solutions(offering, solutions, preferences, opts):
+    if len(solutions) == 1:
+        schedule, num_conflicts = solutions[0]
+        format_schedules(offering, schedule, num_conflicts, schedule.slotlist, preferences, opts)
+        return
+    for i, (schedule, num_conflicts) in enumerate(solutions):
+        format_schedules(offering, schedule, num_conflicts, schedule.slotlist, preferences, opts, i + 1)
+
+def write_outputs(offering, solutions, preferences, opts):
+    """Write solutions to the -o and -H files, if any. Each file is replaced
+    in one step, so it always holds a whole schedule, even mid-run."""
+    schedule, num_conflicts = solutions[0]
+    saved_stdout = sys.stdout
+    try:
+        if opts.output_file != "":
+            # XXX I really can't vouch for this redirection hack:
+            with replacing_file(opts.output_file) as sys.stdout:
+                format_solutions(offering, solutions, preferences, opts)
+        if opts.html_output_file != "":
+            # XXX redirection hack again
+            with replacing_file(opts.html_output_file) as sys.stdout:
+                if len(solutions) == 1:
+                    format_schedules_html(offering, schedule, num_conflicts, preferences, opts)
+                else:
+                    format_solutions_html(offering, solutions, preferences, opts)
+    finally:
+        sys.stdout = saved_stdout
+
+def course_components(courses, overlap, teacher_courses):
+  """Split courses into groups linked by shared students or teachers."""
+  parent = dict((c, c) for c in courses)
+  def find(c):
+    while parent[c] != c:
+      parent[c] = parent[parent[c]]
+      c = parent[c]
+    return c
+  def union(c1, c2):
+    parent[find(c1)] = find(c2)
+
+  for course1, course2 in overlap.keys():
+    union(course1, course2)
+  for course_list in teacher_courses.values():
+    for course in course_list[1:]:
+      union(course_list[0], course)
+
+  components = {}
+  for course in sorted(courses):
+    components.setdefault(find(course), []).append(course)
+  return sorted(components.values(), key=lambda l: (-len(l), l[0]))
+
+def solve_component(job):
+  """Solve one part of a split problem; also returns the part's metrics
+  phase records, which would otherwise stay behind in a Pool worker."""
+  offering, preferences, schedule, opts = job
+  num_phases = len(metrics.phases)
+  result = gen_schedules(offering, preferences, schedule, opts)[0]
+  phases = metrics.phases[num_phases:]
+  del metrics.phases[num_phases:]
+  return result, phases
+
+def solve_components(offering, preferences, schedule, opts, components,
+                     overlap):
+  """Solve each component as its own ILP, on up to opts.jobs processes,
+  and merge the results into one schedule. Components without any overlap
+  are lumped together, since their courses can't conflict anyway."""
+  linked = set([c1 for c1, _c2 in overlap.keys()])
+  parts, trivial = [], []
+  for courses in components:
+    if linked.intersection(courses):
+      parts.append(courses)
+    else:
+      trivial.extend(courses)
+  if trivial: parts.append(trivial)
+
+  # All parts together get the -t limit, each its share as a deadline (see
+  # solver_seconds): side by side, the parts go in rounds of one per worker,
+  # and the parts of the k-th round end by k rounds' worth of the time.
+  workers = max(1, min(opts.jobs, len(parts)))
+  rounds = (len(parts) + workers - 1) // workers
+  started, seconds = time.time(), solver_seconds(opts)
+  jobs = []
+  for i, courses in enumerate(parts):
+    sub_opts = copy.copy(opts)
+    sub_opts.decompose = False
+    sub_opts.stream = False # -- a part's schedule isn't one to save.
+    sub_opts.deadline = started + seconds * (i // workers + 1) / rounds
+    course_set = set(courses)
+    sub_offering = Preferences()
+    for teacher, course_list in offering.people.items():
+      if course_set.intersection([c for c, _c in course_list]):
+        sub_offering.add_preferences(teacher, list(course_list))
+    jobs.append((sub_offering, preferences.restricted_to(course_set),
+                 schedule.restricted_to(course_set, sub_offering.people),
+                 sub_opts,))
+  print "Split the problem into %d independent parts of %s courses." \
+      % (len(parts), ", ".join([str(len(courses)) for courses in parts]))
+
+  if workers > 1:
+    pool = multiprocessing.Pool(workers)
+    # (map_async lets Ctrl-C through to the parent, unlike plain map; the
+    # first one only stops the workers' solvers, see solver_running.)
+    with incumbents.solver_running():
+      results = pool.map_async(solve_component, jobs).get(999999)
+    pool.close()
+    pool.join()
+  else:
+    # -- one at a time, each part gets an even share of what's left; the
+    # -- smallest go first, so that the time they don't need isn't lost.
+    results = [None] * len(jobs)
+    for i in reversed(range(len(jobs))):
+      left = started + seconds - time.time()
+      jobs[i][3].deadline = time.time() + max(0, left) / (i + 1)
+      results[i] = solve_component(jobs[i])
+
+  assignment, num_conflicts, optimal, lower_bound = {}, 0, True, 0
+  for i, ((part_schedule, part_conflicts), phases) in enumerate(results):
+    for record in phases: record["part"] = i + 1
+    metrics.phases.extend(phases)
+    assignment.update(part_schedule.courses)
+    optimal = optimal and part_schedule.optimal
+    if part_schedule.lower_bound is None or lower_bound is None:
+      lower_bound = None
+    else:
+      lower_bound += part_schedule.lower_bound
+    if part_conflicts < 0 or num_conflicts < 0:
+      num_conflicts = -1 # -- some part has no solution.
+    else:
+      num_conflicts += part_conflicts
+  if opts.stream:
+    offer_assignment(offering, preferences, schedule, opts, assignment,
+                     num_conflicts, "parts")
+  merged_schedule = schedule_from_assignment(offering, schedule, assignment,
+                                             optimal)
+  merged_schedule.lower_bound = lower_bound
+  return [(merged_schedule, num_conflicts,)]
+
+def portfolio_configs(opts, count):
+  """Return (name, opts) for the first count solver configurations to race;
+  the first is always the configuration given on the command line."""
+  variants = [("as given", {}),
+              ("local search", {"engine": "local"}),
+              ("CBC seed 1", {"cbc_options": "randomCbcSeed 1"}),
+              ("no symmetry breaking", {"symmetry_breaking": False}),
+              ("CBC seed 2", {"cbc_options": "randomCbcSeed 2"}),
+              ("no warm start", {"warm_start": False}),
+              ("CBC cuts off", {"cbc_options": "cuts off"}),
+              ("CBC seed 3", {"cbc_options": "randomCbcSeed 3"})]
+  configs = []
+  for i in range(count):
+    name, changes = variants[i % len(variants)]
+    member_opts = copy.copy(opts)
+    member_opts.portfolio = 0
+    member_opts.jobs = 1 # -- the members already use a process each.
+    member_opts.stream = False # -- the parent saves the winner.
+    for key, value in changes.items():
+      if key == "cbc_options": value = opts.cbc_options + " " + value
+      setattr(member_opts, key, value)
+    if i >= len(variants): # -- cycle around with fresh seeds:
+      name += " (seed %d)" % (i + 1)
+      member_opts.cbc_options += " randomCbcSeed %d" % (i + 1)
+    configs.append((name, member_opts,))
+  return configs
+
+def run_portfolio_member(name, offering, preferences, schedule, opts, results):
+  os.setpgrp() # -- own process group, so CBC can be stopped along with us.
+  sys.stdout = open(os.devnull, "w")
+  started = time.time()
+  with incumbents.solver_running(): # -- SIGINT: stop at the best so far.
+    solutions = gen_schedules(offering, preferences, schedule, opts)
+  results.put((name, solutions, time.time() - started,))
+
+def gen_schedules_portfolio(offering, preferences, schedule, opts):
+  """Race opts.portfolio configurations of gen_schedules in parallel and
+  keep the best schedule. Stops as soon as one run proves optimality."""
+  configs = portfolio_configs(opts, opts.portfolio)
+  print "Racing %d solver configurations: %s." \
+      % (len(configs), ", ".join([name for name, _opts in configs]))
+
+  results = multiprocessing.Queue()
+  members = []
+  deadline = time.time() + int(opts.time_limit)*60
+  for name, member_opts in configs:
+    member_opts.deadline = deadline # -- all of the solving within -t.
+    member = multiprocessing.Process(target=run_portfolio_member,
+        args=(name, offering, preferences, schedule, member_opts, results,))
+    member.start()
+    members.append(member)
+
+  def stop_members(): # -- Ctrl-C: each member stops at its best so far.
+    for member in members:
+      if member.is_alive():
+        try:
+          os.killpg(member.pid, signal.SIGINT)
+        except OSError:
+          pass
+
+  best, num_finished, stopped = None, 0, False
+  try:
+    while num_finished < len(members):
+      try:
+        with incumbents.solver_running(stop_members):
+          name, solutions, elapsed = \
+              results.get(timeout=max(1, deadline - time.time()))
+        member_schedule, num_conflicts = solutions[0]
+      except Queue.Empty:
+        if time.time() < deadline:
+          # -- Ctrl-C cuts the wait short; the members stop soon after.
+          if incumbents.interrupted:
+            deadline = min(deadline, time.time() + 10)
+          continue
+        if not stopped and not incumbents.interrupted:
+          # -- out of time: stop the members as Ctrl-C would, so that they
+          # -- report their best schedules, and give them a minute to.
+          print "Out of time; stopping the remaining configurations."
+          stop_members()
+          stopped, deadline = True, time.time() + 60
+          continue
+        print "Out of time waiting for the remaining configurations."
+        break
+      num_finished += 1
+      print "Configuration '%s' finished after %.1f seconds: %d conflicts%s." \
+          % (name, elapsed, num_conflicts,
+             " (optimal)" if member_schedule.optimal else "")
+      if num_conflicts >= 0 and (best is None or num_conflicts < best[2]):
+        best = (name, solutions, num_conflicts, elapsed,)
+        if opts.stream:
+          incumbents.offer(num_conflicts, "portfolio: " + name, lambda:
+              write_outputs(offering, solutions, preferences, opts))
+      if member_schedule.optimal: break
+      if num_conflicts >= 0 and member_schedule.lower_bound is not None \
+          and within_gap(num_conflicts, member_schedule.lower_bound, opts):
+        print "That is within the gap of the lower bound."
+        break
+  finally:
+    for member in members: # -- stop whatever is still running.
+      if member.is_alive():
+        try:
+          os.killpg(member.pid, signal.SIGTERM)
+        except OSError:
+          member.terminate()
+      member.join()
+
+  if best is None:
+    print "No configuration found a schedule."
+    return [(schedule_from_assignment(offering, schedule, {}), -1,)]
+  name, solutions, num_conflicts, elapsed = best
+  print "Best schedule came from configuration '%s' after %.1f seconds." \
+      % (name, elapsed)
+  return solutions
+
+def solver_seconds(opts):
+  """Seconds the solver may take: the -t limit, or what's left until
+  opts.deadline for a part of a split problem (see solve_components) or a
+  member of a portfolio.
+  Once stopped (Ctrl-C, or the end of a portfolio race), only a second,
+  to get the starting schedule back."""
+  if incumbents.interrupted: return 1
+  seconds = int(opts.time_limit)*60
+  if opts.deadline is not None:
+    seconds = min(seconds, opts.deadline - time.time())
+  return max(1, int(seconds))
+
+def plural(n):
+  """The "s" for n of something, if any."""
+  return "" if n == 1 else "s"
+
+def within_gap(num_conflicts, lower_bound, opts):
+  """Whether a schedule is close enough to the lower bound to stop, i.e.
+  within opts.gap_conflicts of it, or opts.gap_ratio of its conflicts."""
+  gap = num_conflicts - lower_bound
+  return gap <= opts.gap_conflicts + 1e-6 \
+      or gap <= opts.gap_ratio*num_conflicts + 1e-6
+
+def schedule_from_assignment(offering, template, assignment, optimal=False):
+  """Build a Schedule from a {course: slot} map, keeping template's slots."""
+  teacher_of = {}
+  for teacher, courses in offering.people.items():
+    for course, _comment in courses:
+      teacher_of.setdefault(course, teacher)
+
+  resulting_schedule = Schedule()
+  for course, slot in assignment.items():
+    resulting_schedule.add(teacher_of.get(course), course, slot)
+  resulting_schedule.slotlist = template.slotlist
+  resulting_schedule.optimal = optimal
+  return resulting_schedule
+
+def offer_assignment(offering, preferences, template, opts, assignment,
+                     num_conflicts, source):
+  """Save a {course: slot} map to the -o and -H files as soon as it's found,
+  if it's the best schedule so far."""
+  incumbents.offer(num_conflicts, source, lambda: write_outputs(offering,
+      [(schedule_from_assignment(offering, template, assignment),
+        num_conflicts,)], preferences, opts))
+
+def count_new_rows(prob, record, first_row):
+  """Store how many rows prob gained since first_row, and their nonzeros."""
+  rows = prob.constraints.values()[first_row:]
+  record["constraints"] = len(rows)
+  record["nonzeros"] = sum([len(row) for row in rows])
+
 def gen_schedules(offering, preferences, schedule, opts):
   all_teachers = set(flatten(offering.people.keys()))
-  all_students = set(flatten(preferences.people.keys()))
   all_courses = set(flatten([[c for c, _c in l] for l in offering.people.values()]))
-  classlists = preferences.classes # -- courses that were actually requested.
   all_slots = schedule.slotlist
 
+  # overlap[course1, course2] == number of students taking both courses.
+  # Only pairs of distinct courses sharing at least one student are kept.
+  with metrics.phase("overlap") as record:
+    adjacency = preferences.course_adjacency() # -- sparse, from the CSR arrays.
+    overlap = {}
+    for course1 in all_courses:
+      for course2, overlap_size in adjacency.get(course1, {}).items():
+        if course2 in all_courses:
+          overlap[course1, course2] = overlap_size
+    record["courses"], record["overlapping_pairs"] = len(all_courses), len(overlap)
+  # print overlap # TODO formatting an overlap list may be useful!
+
+  # Courses sharing no students and no teachers can be scheduled separately:
+  teacher_courses = dict((t, [c for c, _c in offering.people[t]]) \
+                         for t in all_teachers)
+  if opts.engine == "ilp" and opts.decompose and opts.num_solutions == 1:
+    components = course_components(all_courses, overlap, teacher_courses)
+    if len(components) > 1:
+      return solve_components(offering, preferences, schedule, opts,
+                              components, overlap)
+
+  # conflict_pairs lists the (course1, course2) pairs that get a conflict
+  # variable. The dense model keeps every ordered pair; the sparse model
+  # keeps one unordered pair for each pair of courses that share students.
+  num_ordered_pairs = len(overlap)
+  course_order = sorted(all_courses)
+  if opts.sparse:
+    conflict_pairs = [(c1, c2) for i, c1 in enumerate(course_order) \
+                      for c2 in course_order[i+1:] \
+                      if overlap.get((c1, c2), 0) > 0]
+  else:
+    conflict_pairs = [(c1, c2) for c1 in all_courses for c2 in all_courses]
+
+  # conflict_weight[course1, course2] == objective coefficient of the pair.
+  conflict_weight = {}
+  for course1, course2 in conflict_pairs:
+    overlap_size = overlap.get((course1, course2), 0)
+    # sometimes we need to deprioritize a course to gain extra flexibility
+    #if course1 == "Drama" or course2 == "Drama": overlap_size /= 10.0
+    if overlap_size > 0: # -- there could be actual conflicts here:
+      if not opts.sparse: # -- each conflict is seen from both courses,
+        overlap_size = overlap_size/2.0 # -- so avoid counting it twice.
+      conflict_weight[course1, course2] = overlap_size
+
+  if opts.sparse:
+    num_dense_rows = len(all_courses) + len(all_teachers)*len(all_slots) \
+        + num_ordered_pairs*len(all_slots)
+    num_sparse_rows = len(all_courses) + len(all_teachers)*len(all_slots) \
+        + len(conflict_pairs)*len(all_slots)
+    print "Sparse model: %d conflict variables, %d constraints in (1)-(3)" \
+        % (len(conflict_pairs), num_sparse_rows)
+    print "(the dense model would have had %d and %d, respectively)." \
+        % (len(all_courses)*len(all_courses), num_dense_rows)
+
+  # Entries pinned by the template (4) and by teacher "X" marks (5):
+  fixed_entries = []
+  for slot, course_map in schedule.timeslots.items():
+    for course in course_map.values():
+      fixed_entries.append((slot, course))
+  forbidden_entries = []
+  for teacher, items in schedule.bad_slots.items():
+    for slot in items:
+      for course, _comment in offering.people[teacher]:
+        print "CONSTRAINT %s : %s no %s" % (teacher, slot, course)
+        forbidden_entries.append((slot, course))
+
+  slot_groups = []
+  if opts.symmetry_breaking:
+    slot_groups = interchangeable_slots(schedule)
+
+  # Presolve: the courses the template fixes (and those left with a single
+  # slot) become constants, as do the slots ruled out by "X" marks, instead
+  # of variables pinned by rows (4) and (5); courses sharing no students
+  # with any other are left out of the model and placed afterwards.
+  with metrics.phase("presolve") as record:
+    presolved = presolve(course_order, all_slots, teacher_courses, overlap,
+                         fixed_entries, forbidden_entries)
+    record["fixed"], record["set_aside"] = \
+        len(presolved.fixed), len(presolved.set_aside)
+    record["model_schedule_variables"] = presolved.num_variables()
+  if presolved.infeasible:
+    for course, reason in presolved.infeasible:
+      print "ERROR: %s can't be scheduled: %s." % (course, reason)
+    return [(schedule_from_assignment(offering, schedule, {}), -1,)]
+
+  # A lower bound on the conflicts (see lower_bound.py), reported with the
+  # result; the solver stops once its schedule is within the --gap of it.
+  with metrics.phase("lower bound") as record:
+    lower_bound, bound_parts = conflict_lower_bound(course_order,
+        teacher_courses, overlap, presolved.allowed, presolved.fixed)
+    record["bound"] = lower_bound
+  print "Lower bound: %d conflict%s (%d between fixed courses, %d with fixed" \
+      " courses, %d in %d clique%s of courses)." % (lower_bound,
+      plural(lower_bound), bound_parts["fixed"],
+      bound_parts["fixed neighbours"], bound_parts["cliques"],
+      bound_parts["num_cliques"], plural(bound_parts["num_cliques"]))
+  def bounded(solutions):
+    for solution_schedule, _num_conflicts in solutions:
+      solution_schedule.lower_bound = lower_bound
+    return solutions
+
+  # A greedy colouring gives the solver a feasible schedule to start from:
+  warm_start = None
+  if opts.warm_start or opts.engine == "local":
+    with metrics.phase("greedy start") as record:
+      warm_start = dsatur_assignment(course_order, all_slots, teacher_courses,
+                                     overlap, fixed_entries, forbidden_entries)
+      if warm_start is not None:
+        # -- row (6) only ranks the slots by the courses in the model:
+        warm_start = order_slot_groups(warm_start, slot_groups,
+                                       presolved.courses)
+        warm_conflicts = count_assignment_conflicts(warm_start, overlap)
+        record["conflicts"] = warm_conflicts
+    if warm_start is None:
+      print "Greedy colouring found no feasible starting schedule."
+    else:
+      print "Greedy colouring found a starting schedule with %d conflicts" \
+          " in %.3f seconds." % (warm_conflicts, metrics.phases[-1]["seconds"])
+      if opts.stream:
+        offer_assignment(offering, preferences, schedule, opts, warm_start,
+                         warm_conflicts, "greedy start")
+      if within_gap(warm_conflicts, lower_bound, opts) \
+          and opts.num_solutions == 1: # -- nothing more to look for.
+        print "The greedy schedule is within the gap of the lower bound."
+        return bounded([(schedule_from_assignment(offering, schedule,
+            warm_start, warm_conflicts <= lower_bound), warm_conflicts,)])
+
+  if opts.engine == "local":
+    if warm_start is None:
+      print "ERROR: local search needs a feasible schedule to start from."
+      return [(schedule_from_assignment(offering, schedule, {}), -1,)]
+    with metrics.phase("local search") as record:
+      with incumbents.solver_running():
+        assignment, num_conflicts, num_moves = anneal_assignment(course_order,
+            all_slots, teacher_courses, overlap, warm_start, fixed_entries,
+            forbidden_entries, solver_seconds(opts),
+            stop=lambda best: incumbents.interrupted \
+                or within_gap(best, lower_bound, opts))
+      record["moves"], record["conflicts"] = num_moves, num_conflicts
+    print "Local search tried %d moves in %.1f seconds." \
+        % (num_moves, metrics.phases[-1]["seconds"])
+    if opts.stream:
+      offer_assignment(offering, preferences, schedule, opts, assignment,
+                       num_conflicts, "local search")
+    return bounded([(schedule_from_assignment(offering, schedule, assignment,
+        num_conflicts <= lower_bound), num_conflicts,)])
+
+  if opts.backend == "highs":
+    # (scipy.optimize.milp takes no MIP start, so the greedy schedule is
+    # only kept as a fallback in case HiGHS finds nothing better in time.)
+    with metrics.phase("solve (highs)") as record:
+      results = solve_matrix_model(course_order, all_slots, teacher_courses,
+          conflict_pairs, conflict_weight, fixed_entries, forbidden_entries,
+          slot_groups, solver_seconds(opts), opts.num_solutions,
+          opts.tolerance, record)
+    if warm_start is not None and \
+        (results[0][1] < 0 or warm_conflicts < results[0][1]):
+      results[0] = (warm_start, warm_conflicts, False,)
+    if opts.stream and results[0][1] >= 0:
+      offer_assignment(offering, preferences, schedule, opts, results[0][0],
+                       results[0][1], "highs")
+    return bounded([(schedule_from_assignment(offering, schedule, assignment,
+        optimal), num_conflicts,) for assignment, num_conflicts, optimal in results])
+
+  model_courses, fixed_slot = presolved.courses, presolved.fixed
+  model_set = set(model_courses)
+  model_order = [c for c in course_order if c in model_set]
+  # -- pairs of fixed courses need no conflict variable; their conflicts
+  # -- are a constant part of the objective.
+  in_model = lambda c: c in model_set or c in fixed_slot
+  model_pairs = [(c1, c2) for c1, c2 in conflict_pairs \
+                 if in_model(c1) and in_model(c2) \
+                 and not (c1 in fixed_slot and c2 in fixed_slot)]
+  fixed_conflicts = sum([weight for (c1, c2), weight in conflict_weight.items() \
+                         if c1 in fixed_slot and c2 in fixed_slot \
+                         and fixed_slot[c1] == fixed_slot[c2]])
+  print "Presolve fixed %d courses, ruled out %d more slots and set aside" \
+      " %d courses that share no students;" % (len(fixed_slot),
+      sum([len(all_slots) - len(presolved.allowed[c]) for c in model_courses]),
+      len(presolved.set_aside))
+  print "the model keeps %d of the %d schedule variables and %d of the %d" \
+      " conflict variables." % (presolved.num_variables(),
+      len(all_slots)*len(all_courses), len(model_pairs), len(conflict_pairs))
+  # With a --gap, CBC stops once its schedule is within the gap of its own
+  # bound, which row (7) keeps at least as high as ours. (The row slows down
+  # proving optimality, so it's left out otherwise. And CBC reports a
+  # schedule within the gap as optimal, which it only is if it meets our
+  # bound.)
+  cbc_options = opts.cbc_options.split()
+  if opts.gap_conflicts > 0: # -- (CBC wants the gap to be strictly less)
+    cbc_options += ['allowableGap', str(opts.gap_conflicts + 1e-3)]
+  if opts.gap_ratio > 0:
+    cbc_options += ['ratioGap', str(opts.gap_ratio + 1e-6)]
+  if opts.deadline is not None: # -- CBC counts CPU seconds otherwise.
+    cbc_options += ['timeMode', 'elapsed']
+  exact = opts.gap_conflicts == 0 and opts.gap_ratio == 0
+
+  if not model_courses: # -- nothing left to solve.
+    assignment = presolved.complete({})
+    num_conflicts = count_assignment_conflicts(assignment, overlap)
+    if opts.stream:
+      offer_assignment(offering, preferences, schedule, opts, assignment,
+                       num_conflicts, "presolve")
+    return bounded([(schedule_from_assignment(offering, schedule, assignment,
+                                              True), num_conflicts,)])
+
+  # Each variable of the model has a key, ("scheduled", slot, course),
+  # ("conflict", course1, course2) or ("seen", slot, i); see variable_of.
+  def model_keys():
+    keys = [("scheduled", s, c) for c in model_courses \
+            for s in presolved.allowed[c]]
+    keys += [("conflict", c1, c2) for c1, c2 in model_pairs]
+    keys += [("seen", s, i) for group in slot_groups for s in group[:-1] \
+             for i in range(1, len(model_order))]
+    return keys
+
+  def start_values_for(assignment):
+    start_values = []
+    for course in model_courses:
+      for slot in presolved.allowed[course]:
+        start_values.append((("scheduled", slot, course),
+                             int(assignment[course] == slot)))
+    for course1, course2 in model_pairs:
+      start_values.append((("conflict", course1, course2), int(course1 != course2 \
+                           and assignment[course1] == assignment[course2])))
+    for group in slot_groups:
+      for prev_slot in group[:-1]:
+        num_seen = 0
+        for i, course in enumerate(model_order[1:], 1):
+          num_seen += int(assignment[model_order[i-1]] == prev_slot)
+          start_values.append((("seen", prev_slot, i), num_seen))
+    return start_values
+
+  def solve_cached_model(entry):
+    """Solve a model from the model cache, as solve_model below solves prob,
+    and return the schedule found."""
+    options = ['sec', str(solver_seconds(opts))] + cbc_options
+    if warm_start is not None:
+      start_fd, start_path = tempfile.mkstemp(suffix="-pulp.mst")
+      write_mip_start(os.fdopen(start_fd, "w"), entry.columns,
+                      start_values_for(warm_start))
+      options += ['mips', start_path]
+    with metrics.phase("solve") as record:
+      record["model_variables"] = entry.num_variables
+      record["model_constraints"] = entry.num_constraints
+      try:
+        if incumbents.interrupted: # -- Ctrl-C: solve no more.
+          status, values = LpStatusNotSolved, {}
+        else:
+          status, values = run_solver(lambda: run_cbc(entry.model_path,
+              options, entry.columns, opts.stream), opts.stream,
+              fixed_conflicts)
+      finally:
+        if warm_start is not None: os.remove(start_path)
+      record["status"] = LpStatus[status]
+
+    with metrics.phase("extraction") as record:
+      assignment = presolved.complete(dict((course, slot) \
+          for (kind, slot, course), x in values.items() \
+          if kind == "scheduled" and x > 0.5))
+      num_conflicts = count_assignment_conflicts(assignment, overlap)
+      optimal = status == LpStatusOptimal \
+          and (exact or num_conflicts <= lower_bound)
+      record["conflicts"] = num_conflicts
+    if len(assignment) != len(all_courses):
+      if warm_start is None:
+        return bounded([(schedule_from_assignment(offering, schedule,
+                                                  assignment), -1,)])
+      print "Solver returned no complete schedule; keeping the greedy one."
+      assignment, num_conflicts, optimal = warm_start, warm_conflicts, False
+    if opts.stream:
+      offer_assignment(offering, preferences, schedule, opts, assignment,
+                       num_conflicts, "solver")
+    return bounded([(schedule_from_assignment(offering, schedule, assignment,
+                                              optimal), num_conflicts,)])
+
+  # The same model may have been built by an earlier run (unless --lazy or
+  # -n are to change it as they go); if so, go straight to the solver:
+  cache_key = None
+  if model_cache.enabled and not opts.lazy and opts.num_solutions == 1:
+    with metrics.phase("model cache") as record:
+      cache_key = model_cache.model_key(__file__, course_order, all_slots,
+          sorted(teacher_courses.items()), sorted(conflict_pairs),
+          sorted(conflict_weight.items()), sorted(fixed_entries),
+          sorted(forbidden_entries), slot_groups, model_courses,
+          sorted(presolved.allowed.items()), sorted(fixed_slot.items()),
+          None if exact else lower_bound)
+      cached_model = model_cache.lookup(cache_key)
+      record["hit"] = cached_model is not None
+    if cached_model is not None:
+      print "Found the model in the cache (%d variables, %d constraints)." \
+          % (cached_model.num_variables, cached_model.num_constraints)
+      return solve_cached_model(cached_model)
+
   prob = LpProblem("Course Scheduling", LpMinimize)
 
   ## Define variables:
 
-  # scheduled[slot, course] == 1 : course scheduled in slot.
-  names = [s+"_"+c for s in all_slots for c in all_courses]
-  scheduled = LpVariable.dicts("Scheduled_", names, 0, 1, LpInteger)
-  def get_scheduled(s, c): return scheduled[s+"_"+c]
+  with metrics.phase("variables") as record:
+    # scheduled[slot, course] == 1 : course scheduled in slot.
+    # Only for the model's courses, in their allowed slots; otherwise it's
+    # a constant: 1 in a fixed course's slot, and 0 elsewhere.
+    names = [s+"_"+c for s in all_slots for c in all_courses \
+             if c in model_set and s in presolved.allowed[c]]
+    scheduled = LpVariable.dicts("Scheduled_", names, 0, 1, LpInteger)
+    def get_scheduled(s, c):
+      if c in fixed_slot: return int(s == fixed_slot[c])
+      return scheduled.get(s+"_"+c, 0)
+    def is_zero(term): return isinstance(term, int) and term == 0
 
-  # conflict[course1, course2] == 1 : courses in same slot.
-  names = [c1+"_"+c2 for c1 in all_courses for c2 in all_courses]
-  conflict = LpVariable.dicts("Conflict_", names, 0, 1, LpInteger)
-  def get_conflict(c1, c2): return conflict[c1+"_"+c2]
+    # conflict[course1, course2] == 1 : courses in same slot.
+    names = [c1+"_"+c2 for c1, c2 in model_pairs]
+    conflict = LpVariable.dicts("Conflict_", names, 0, 1, LpInteger)
+    def get_conflict(c1, c2): return conflict[c1+"_"+c2]
+    record["variables"] = len(scheduled) + len(conflict)
 
   print "Created %d schedule variables and %d conflict variables." \
-      % (len(all_slots)*len(all_courses), len(all_courses)*len(all_courses))
+      % (len(scheduled), len(conflict))
 
   ## Define objective function:
 
-  # overlap[course1, course2] == number of students taking both courses.
-  overlap, total_conflicts = {}, 0
-  for course1 in all_courses:
-    if course1 not in classlists: continue # -- no one was interested.
-    for course2 in all_courses:
-      if course2 not in classlists: continue # -- no one was interested.
-      if course1 == course2: continue # -- a course can't conflict with itself.
-      overlap_size = len(classlists[course1]&classlists[course2])
-      overlap[course1, course2] = overlap_size
-      # sometimes we need to deprioritize a course to gain extra flexibility
-      #if course1 == "Drama" or course2 == "Drama": overlap_size /= 10.0
-      if overlap_size > 0: # -- there could be actual conflicts here:
-        total_conflicts += (overlap_size/2.0) * get_conflict(course1, course2)
-        # ... division by 2.0 is necessary to avoid counting conflicts twice.
-  # print overlap # TODO formatting an overlap list may be useful!
-  def get_overlap(c1, c2): return overlap[c1, c2]
-  prob += total_conflicts, "minimize the number of conflicts."
+  with metrics.phase("objective") as record:
+    total_conflicts = LpAffineExpression(constant=fixed_conflicts)
+    for course1, course2 in model_pairs:
+      if (course1, course2) in conflict_weight:
+        total_conflicts += conflict_weight[course1, course2] \
+            * get_conflict(course1, course2)
+    prob += total_conflicts, "minimize the number of conflicts."
+    record["nonzeros"] = len(prob.objective)
   
   print "Calculated %d course overlaps and objective function." \
       % (len(all_courses)*len(all_courses))
@@ -197,94 +889,253 @@ def gen_schedules(offering, preferences, schedule, opts):
   print "Defining constraints:"
 
   print "(1) every course is scheduled in exactly one slot"
-  pbar, i = ProgressBar(len(all_slots)*len(all_courses)).start(), 0
-  for course in all_courses:
-    places_scheduled = 0
-    for slot in all_slots:
-      places_scheduled += get_scheduled(slot, course)
-      i = i+1; pbar.update(i) # -- display a progress bar.
-    prob += places_scheduled == 1, "%s sched." % (course)
-  pbar.finish()
+  with metrics.phase("constraints (1)") as record:
+    first_row = len(prob.constraints)
+    for course in model_courses:
+      places_scheduled = 0
+      for slot in presolved.allowed[course]:
+        places_scheduled += get_scheduled(slot, course)
+      prob += places_scheduled == 1, "%s sched." % (course)
+    count_new_rows(prob, record, first_row)
 
   print "(2) absolutely no course conflicts for the teachers"
-  pbar, i = ProgressBar(len(all_teachers) * len(all_slots)).start(), 0
-  for teacher in all_teachers:
-    for slot in all_slots:
-      courses_in_slot = 0
-      for course, _comment in offering.people[teacher]:
-        # course_no = all_courses.index(course)
-        courses_in_slot += get_scheduled(slot, course)
-      prob += courses_in_slot <= 1, "%s no conf. at %s" % (teacher, slot)
-      i = i+1; pbar.update(i) # -- display a progress bar.
-  pbar.finish()
-
-  print "(3) our conflict table contains correct values"
-  pbar, i = \
-      ProgressBar(len(all_courses)*len(all_courses)*len(all_slots)).start(), 0
-  for course1 in all_courses:
-    if course1 not in classlists: continue # -- no one was interested.
-    for course2 in all_courses:
+  with metrics.phase("constraints (2)") as record:
+    first_row = len(prob.constraints)
+    for teacher in all_teachers:
+      for slot in all_slots:
+        courses_in_slot = 0
+        for course, _comment in offering.people[teacher]:
+          # course_no = all_courses.index(course)
+          courses_in_slot += get_scheduled(slot, course)
+        # -- (presolve has ruled out the slots of the teacher's fixed courses)
+        if not isinstance(courses_in_slot, LpAffineExpression) \
+            or len(courses_in_slot) < 2: continue
+        prob += courses_in_slot <= 1, "%s no conf. at %s" % (teacher, slot)
+    count_new_rows(prob, record, first_row)
+
+  def add_conflict_row(course1, course2, slot):
+    comment_str = "%s and %s conf. at %s" % (course1, course2, slot)
+    scheduled1, scheduled2 = get_scheduled(slot, course1), get_scheduled(slot, course2)
+    if is_zero(scheduled1) or is_zero(scheduled2): return # -- can't both be.
+    lhs = scheduled1 + scheduled2 - 1
+    prob.addConstraint(lhs <= get_conflict(course1, course2), comment_str)
+
+  if opts.lazy:
+    print "(3) our conflict table contains correct values [added lazily]"
+  else:
+    print "(3) our conflict table contains correct values"
+  with metrics.phase("constraints (3)") as record:
+    first_row = len(prob.constraints)
+    for course1, course2 in model_pairs:
       # Check if an actual conflict here is even possible:
-      if course2 not in classlists: continue # -- no one was interested.
-      if course1 == course2: continue # -- a course can't conflict with itself.
-      if get_overlap(course1, course2) == 0: continue
+      if (course1, course2) not in conflict_weight: continue
+      # -- lazily, start with the pairs the warm start puts together (so that
+      # -- its conflicts are counted); solve_model adds the others as needed.
+      if opts.lazy and (warm_start is None or \
+                        warm_start[course1] != warm_start[course2]): continue
 
       # ... and then define the actual constraint for each slot:
       for slot in all_slots:
-        comment_str = "%s and %s conf. at %s" % (course1, course2, slot)
-        lhs = get_scheduled(slot, course1) + get_scheduled(slot, course2) - 1
-        prob += lhs <= get_conflict(course1, course2), comment_str
-        i = i+1; pbar.update(i)
-  pbar.finish()
+        add_conflict_row(course1, course2, slot)
+    count_new_rows(prob, record, first_row)
 
-  print "(4) existing scheduled entries are in the solution [constraints]"
-  for slot, course_map in schedule.timeslots.items():
-    for course in course_map.values():
-      comment_str = "%s sched. at %s" % (slot, course)
-      prob += get_scheduled(slot, course) == 1
+  print "(4) existing scheduled entries are in the solution [substituted by presolve]"
+  print "(5) EXPERIMENTAL 'teacher can't come in' constraints [substituted by presolve]"
 
-  if True:
-    print "(5) EXPERIMENTAL 'teacher can't come in' constraints"
-    for teacher, items in schedule.bad_slots.items():
-      for slot in items:
-        for course, _comment in offering.people[teacher]:
-          print "CONSTRAINT %s : %s no %s" % (teacher, slot, course)
-          comment_str = "%s not sched. at %s since teach away" % (slot, course)
-          prob += get_scheduled(slot, course) == 0
+  if opts.symmetry_breaking:
+    print "(6) interchangeable slots are used in order of their lowest course"
+    with metrics.phase("constraints (6)") as record:
+      first_row = len(prob.constraints)
+      # Within a group of interchangeable slots, every course in a slot must
+      # be preceded (in course_order) by some course in the previous slot.
+      # seen[slot, i] bounds how many of the first i courses are in the slot.
+      names = [s+"_"+str(i) for group in slot_groups for s in group[:-1] \
+               for i in range(1, len(model_order))]
+      seen = LpVariable.dicts("Seen_", names, 0)
+      def get_seen(s, i): return seen[s+"_"+str(i)]
+      for group in slot_groups:
+        for prev_slot, slot in zip(group[:-1], group[1:]):
+          first_course = model_order[0]
+          prev_seen = get_scheduled(prev_slot, first_course)
+          if not is_zero(get_scheduled(slot, first_course)):
+            prob += get_scheduled(slot, first_course) == 0
+          for i, course in enumerate(model_order[1:], 1):
+            prob += get_seen(prev_slot, i) <= prev_seen
+            if not is_zero(get_scheduled(slot, course)):
+              prob += get_scheduled(slot, course) <= get_seen(prev_slot, i)
+            prev_seen = get_seen(prev_slot, i) \
+                + get_scheduled(prev_slot, course)
+      record["variables"] = len(seen)
+      count_new_rows(prob, record, first_row)
+    print "Found %d group(s) of interchangeable slots, %d slots in total." \
+        % (len(slot_groups), sum([len(group) for group in slot_groups]))
+
+  if not exact and lower_bound > fixed_conflicts:
+    print "(7) there are at least as many conflicts as the lower bound"
+    prob += total_conflicts >= lower_bound, "conflict lower bound"
+
+  def variable_of(key):
+    kind, first, second = key
+    if kind == "scheduled": return get_scheduled(first, second)
+    if kind == "conflict": return get_conflict(first, second)
+    return get_seen(first, second)
+
+  def prob_columns():
+    """{key: MPS column name} for prob, as COIN_CMD writes it out."""
+    _constraint_names, variable_names, _objective_name = prob.normalisedNames()
+    columns = {}
+    for key in model_keys():
+      name = variable_of(key).name
+      if name in variable_names: columns[key] = variable_names[name]
+    return columns
+
+  if cache_key is not None:
+    with metrics.phase("model cache") as record:
+      cached_model = model_cache.store(cache_key, prob,
+          dict((key, variable_of(key)) for key in model_keys()))
+      record["stored"] = cached_model is not None
+    if cached_model is not None:
+      return solve_cached_model(cached_model)
 
   ## Solve the problem and return the solution:
 
   ## MAKE SURE TO USE GLPK SOLVER ON SCHOOL COMPUTERS TODO NO THAT WON'T WORK:
   # solver = solvers.PULP_CBC_CMD(maxSeconds=int(opts.time_limit)*60)
   # solver = solvers.COIN_CMD(maxSeconds=int(opts.time_limit)*60)
-  solver = solvers.COIN_CMD(options=['sec',str(int(opts.time_limit)*60)])
-  # solver = solvers.GLPK(options=['--tmlim', str(opts.time_limit), '--nopresol'])
-  prob.solve(solver=solver)
+  def current_assignment():
+    assignment = {}
+    for course in model_courses:
+      for slot in presolved.allowed[course]:
+        if get_scheduled(slot, course).varValue == 1:
+          assignment[course] = slot
+    return presolved.complete(assignment)
+
+  def solve_model(phase, start=None):
+    """Solve prob, starting from the start assignment if there is one.
+
+    With --lazy, the (3) rows of a pair of courses are only added once a
+    solution violates one of them (both courses in a slot, but no conflict
+    counted), and the model is solved again from that solution, with the
+    conflicts counted, until no row is violated: then the solution is also
+    one of the full model, and optimal for it if the last solve was.
+    Returns None in that case; if time runs out first, returns the best
+    complete schedule seen, as (assignment, conflicts)."""
+    deadline = time.time() + solver_seconds(opts)
+    best, lazy_round = None, 1
+    if opts.lazy and start is not None:
+      best = (start, count_assignment_conflicts(start, overlap))
+    while True:
+      if incumbents.interrupted: return best # -- Ctrl-C: solve no more.
+      seconds = solver_seconds(opts)
+      if opts.lazy: seconds = max(1, int(deadline - time.time()))
+      options = ['sec', str(seconds)] + cbc_options
+      if start is not None:
+        # Hand the start to CBC as a MIP start:
+        start_fd, start_path = tempfile.mkstemp(suffix="-pulp.mst")
+        write_mip_start(os.fdopen(start_fd, "w"), prob_columns(),
+                        start_values_for(start))
+        options += ['mips', start_path]
+      # -- with opts.stream, CBC's log is followed for better solutions
+      # (but not the lazy model's, whose objective undercounts).
+      follow_log = opts.stream and not opts.lazy
+      solver = solvers.COIN_CMD(options=options, msg=int(follow_log))
+      # solver = solvers.GLPK(options=['--tmlim', str(opts.time_limit), '--nopresol'])
+      if lazy_round > 1: phase_name = "%s, lazy round %d" % (phase, lazy_round)
+      else: phase_name = phase
+      with metrics.phase(phase_name) as record:
+        record["model_variables"] = len(prob.variables())
+        record["model_constraints"] = len(prob.constraints)
+        try:
+          run_solver(lambda: prob.solve(solver=solver), follow_log,
+                     fixed_conflicts)
+        finally:
+          if start is not None: os.remove(start_path)
+        record["status"] = LpStatus[prob.status]
+      if not opts.lazy: return None
+
+      assignment = current_assignment()
+      if len(assignment) != len(all_courses): return best # -- nothing new.
+      violated = [(c1, c2) for c1, c2 in model_pairs \
+                  if (c1, c2) in conflict_weight \
+                  and assignment[c1] == assignment[c2] \
+                  and get_conflict(c1, c2).varValue < 0.5]
+      if not violated: return None
+      num_conflicts = count_assignment_conflicts(assignment, overlap)
+      if best is None or num_conflicts < best[1]:
+        best = (assignment, num_conflicts)
+        if opts.stream:
+          offer_assignment(offering, preferences, schedule, opts, assignment,
+                           num_conflicts, "lazy round %d" % lazy_round)
+      if incumbents.interrupted: return best
+      if time.time() >= deadline:
+        print "Out of time with the rows of %d course pairs still missing." \
+            % len(violated)
+        return best
+
+      # -- a pair's rows for the other slots too, or it just moves there.
+      for course1, course2 in violated:
+        for slot in all_slots:
+          add_conflict_row(course1, course2, slot)
+      print "Lazy round %d: added the rows of %d violated course pairs" \
+          " (%d rows in all)." % (lazy_round, len(violated), len(prob.constraints))
+      start, lazy_round = assignment, lazy_round + 1
+
+  fallback = solve_model("solve", warm_start)
 
   # If no solution was found, abort:
   #if LpStatus[prob.status] != "Optimal":
   #  print "ERROR: Linear solver returned '%s'.\n" % LpStatus[prob.status]
   #  return []
 
-  # Build a schedule from the resulting solution:
-  resulting_schedule = Schedule()
-  for slot in all_slots:
-    for course in all_courses:
-      if get_scheduled(slot, course).varValue == 1:
-        the_teacher = None
-        for teacher in all_teachers:
-          course_lst = [a for a, b in offering.people[teacher]]
-          if course in course_lst:
-            the_teacher = teacher
-            break
-        resulting_schedule.add(the_teacher, course, slot)
-  resulting_schedule.slotlist = schedule.slotlist
-
-  # Return our (single) solution:
-  num_conflicts = value(prob.objective)
-  return (resulting_schedule, num_conflicts,)
-
-  # TODO - add constraints for obtaining multiple solutions and solve again...
+  # Collect solutions; to get more of them, cut off each one found and
+  # solve the same model again, within opts.tolerance of the best:
+  solutions, seen_assignments = [], []
+  while True:
+    with metrics.phase("extraction") as record:
+      # Build a schedule from the resulting solution:
+      assignment = current_assignment()
+      num_conflicts = value(prob.objective)
+      optimal = LpStatus[prob.status] == "Optimal" \
+          and (exact or num_conflicts <= lower_bound + 1e-6)
+      if fallback is not None: # -- --lazy ran out of time; see solve_model.
+        assignment, num_conflicts = fallback
+        optimal = False
+      record["conflicts"] = num_conflicts
+
+    # CBC can come back without a usable solution (e.g. out of time, or when
+    # its preprocessing trips over the MIP start); keep the start in that case.
+    if not solutions and warm_start is not None \
+        and len(assignment) != len(all_courses):
+      print "Solver returned no complete schedule; keeping the greedy one."
+      assignment, num_conflicts, optimal = warm_start, warm_conflicts, False
+
+    if len(assignment) != len(all_courses) or assignment in seen_assignments:
+      break # -- no (new) solution this time.
+    if solutions and num_conflicts > solutions[0][1] + opts.tolerance + 1e-6:
+      break
+    resulting_schedule = schedule_from_assignment(offering, schedule,
+                                                  assignment, optimal)
+    solutions.append((resulting_schedule, num_conflicts,))
+    seen_assignments.append(assignment)
+    if opts.stream and len(solutions) == 1:
+      offer_assignment(offering, preferences, schedule, opts, assignment,
+                       num_conflicts, "solver")
+    if len(solutions) >= opts.num_solutions: break
+    if incumbents.interrupted: break
+
+    print "Looking for solution #%d." % (len(solutions) + 1)
+    if len(solutions) == 1 and len(total_conflicts) > 0:
+      prob += total_conflicts <= num_conflicts + opts.tolerance, \
+          "near-optimal solutions only"
+    # -- (the courses presolve sets aside are placed the same way each time)
+    prob += lpSum([get_scheduled(assignment[c], c) for c in model_courses]) \
+        <= len(model_courses) - 1, "not solution #%d" % len(solutions)
+    fallback = solve_model("solve #%d" % (len(solutions) + 1))
+
+  if not solutions: # -- keep the old behaviour of reporting what we got.
+    solutions.append((schedule_from_assignment(offering, schedule, assignment),
+                      value(prob.objective),))
+  return bounded(solutions)
 
 if __name__=="__main__":
     usage = "%prog <preferences> <teacher info> <partial schedule>\n%prog -p <preference file> <partial schedule>"
@@ -295,6 +1146,39 @@ if __name__=="__main__":
 
     parser.add_option('-t', '--solver-time', dest="time_limit", default="4",
                       help="time to spend looking for solution, in minutes")
+    parser.add_option('-e', '--engine', dest="engine", default="ilp", \
+                      type="choice", choices=["ilp", "local"], \
+                      help="'ilp' (solve the ILP model) or 'local' (simulated annealing, no ILP solver needed)")
+    parser.add_option('-j', '--jobs', dest="jobs", type="int", \
+                      default=multiprocessing.cpu_count(), \
+                      help="solve independent parts of the problem on this many processes")
+    parser.add_option('--no-decompose', dest="decompose", \
+                      action="store_false", default=True, \
+                      help="solve the whole problem as one model")
+    parser.add_option('-b', '--backend', dest="backend", default="coin", \
+                      type="choice", choices=["coin", "highs"], \
+                      help="ILP backend: 'coin' (PuLP + CBC) or 'highs' (in-process, needs scipy.optimize.milp)")
+    parser.add_option('--sparse', action="store_true", default=False, \
+                      help="only create conflict variables for course pairs sharing students")
+    parser.add_option('--no-symmetry-breaking', dest="symmetry_breaking", \
+                      action="store_false", default=True, \
+                      help="don't order interchangeable timeslots in the model")
+    parser.add_option('--lazy', action="store_true", default=False, \
+                      help="add the conflict constraints (3) only as solutions violate them, re-solving until none is")
+    parser.add_option('--no-warm-start', dest="warm_start", \
+                      action="store_false", default=True, \
+                      help="don't start the solver from a greedy schedule")
+    parser.add_option('--cbc-options', dest="cbc_options", default="", \
+                      help="extra options passed on to CBC, e.g. 'randomCbcSeed 7'")
+    parser.add_option('-n', '--num-solutions', dest="num_solutions", \
+                      type="int", default=1, \
+                      help="find up to this many distinct schedules (-t applies to each solve)")
+    parser.add_option('--tolerance', dest="tolerance", type="float", default=0, \
+                      help="with -n, accept schedules with up to this many more conflicts than the best")
+    parser.add_option('--gap', dest="gap", default="0", \
+                      help="stop once the schedule is within this many conflicts of the lower bound, or this percentage of its conflicts (e.g. '5%')")
+    parser.add_option('--portfolio', dest="portfolio", type="int", default=0, \
+                      help="race this many solver configurations and keep the best")
     parser.add_option('-s', '--by-student', action="store_true", \
                       default=False, \
                       help="print conflict report by student, not by course")
@@ -308,45 +1192,104 @@ if __name__=="__main__":
 	                      help="also write results in plaintext to this file")
     parser.add_option('-H', '--html', dest="html_output_file", default="", \
 	                      help="also write results in HTML format to this file")
+    parser.add_option('--trace', dest="trace_file", default="", \
+                      help="write the conflicts of each better schedule found, and when, to this file")
+    parser.add_option('--metrics', dest="metrics_file", default="", \
+                      help="write per-phase timings, memory and model sizes to this JSON file")
+    parser.add_option('--profile', dest="profile_file", default="", \
+                      help="write cProfile statistics for the run to this file")
+    parser.add_option('--no-cache', dest="cache", action="store_false", \
+                      default=True, help="always re-read the input files")
+    parser.add_option('--no-model-cache', dest="model_cache", \
+                      action="store_false", default=True, \
+                      help="always build the model, rather than reuse one built for the same problem")
+    parser.add_option('--model-cache-mb', dest="model_cache_mb", type="int", \
+                      default=1024, \
+                      help="keep at most this many megabytes of built models (default 1024)")
 
     (opts, args) = parser.parse_args()
     opts.show_conflicts = True # we ALWAYS want to see the conflicts
+    if opts.backend == "highs" and not milp_available():
+      parser.error("'-b highs' needs scipy.optimize.milp (SciPy 1.9 or newer, on Python 3.8+), which isn't available")
+    opts.gap_conflicts, opts.gap_ratio = 0, 0
+    try:
+      if opts.gap.endswith("%"):
+        opts.gap_ratio = float(opts.gap[:-1]) / 100
+      else:
+        opts.gap_conflicts = float(opts.gap)
+    except ValueError:
+      parser.error("--gap takes a number of conflicts or a percentage, e.g. '5%'")
+    opts.stream = True # -- save each better schedule as it's found.
+    opts.deadline = None # -- set for the parts of a split problem.
+    incumbents.trace_file = opts.trace_file
+    input_cache.enabled = opts.cache
+    model_cache.enabled = opts.model_cache
+    model_cache.max_bytes = opts.model_cache_mb * 1024 * 1024
+
+    if opts.profile_file != "":
+      profiler = cProfile.Profile()
+      profiler.enable()
 
     if opts.preference_file != "":
       if len(args) != 1:
         parser.error("1 argument required with option '-p': schedule")
       selection_file = args[0]
-      offering, preferences = read_combined_file(opts.preference_file)
-      schedule = Schedule(selection_file)
+      with metrics.phase("parse"):
+        offering, preferences = \
+            input_cache.load_combined_file(opts.preference_file)
+        schedule = input_cache.load_schedule(selection_file)
     else:
       if len(args) != 3:
         parser.error("3 arguments required: students, teachers, and schedule")
       data_dir, off_dir, selection_file = args[0], args[1], args[2]
-      offering = Preferences(off_dir) # -- courses offered by teachers.
-      preferences, schedule = Preferences(data_dir), Schedule(selection_file)
+      with metrics.phase("parse"):
+        offering = input_cache.load_preferences(off_dir) # -- courses offered by teachers.
+        preferences = input_cache.load_preferences(data_dir)
+        schedule = input_cache.load_schedule(selection_file)
+    metrics.phases[-1]["students"] = len(preferences.person_table)
+    metrics.phases[-1]["teachers"] = len(offering.person_table)
 
     # In case a sanity check is needed:
     # print str(offering.people) + " " + str(offering.classes)
     # print str(preferences.people) + " " + str(preferences.classes)
 
-    schedule, num_conflicts = gen_schedules(offering, preferences, schedule, opts)
+    if opts.portfolio > 1:
+      solutions = gen_schedules_portfolio(offering, preferences, schedule, opts)
+    else:
+      solutions = gen_schedules(offering, preferences, schedule, opts)
+    schedule, num_conflicts = solutions[0]
     print "\n" # -- visual separation from the solver output above
-    format_schedules(offering, schedule, num_conflicts, schedule.slotlist, preferences, opts)
+    with metrics.phase("report"):
+      format_solutions(offering, solutions, preferences, opts)
+
+    if schedule.lower_bound is not None and num_conflicts >= 0:
+      print ""
+      if num_conflicts <= schedule.lower_bound:
+        print "Lower bound: %d conflict%s, so this schedule is optimal." \
+            % (schedule.lower_bound, plural(schedule.lower_bound))
+      else:
+        gap = num_conflicts - schedule.lower_bound
+        print "Lower bound: %d conflict%s, so this schedule is at most %g" \
+            " conflict%s (%.1f%% of its conflicts) from the best possible." \
+            % (schedule.lower_bound, plural(schedule.lower_bound), gap,
+               plural(gap), 100.0 * gap / num_conflicts)
 
     # Also save to file, if needed:
+    write_outputs(offering, solutions, preferences, opts)
     if opts.output_file != "":
-      outfile = open(opts.output_file, "w")
-      # XXX I really can't vouch for this redirection hack:
-      with outfile as sys.stdout:
-        format_schedules(offering, schedule, num_conflicts, schedule.slotlist, preferences, opts)
-      sys.stdout = sys.__stdout__
       print ""
       print "(also wrote raw output to " + opts.output_file + ")"
     if opts.html_output_file != "":
-      outfile = open(opts.html_output_file, "w")
-      # XXX redirection hack again
-      with outfile as sys.stdout:
-        format_schedules_html(offering, schedule, num_conflicts, preferences, opts)
-      sys.stdout = sys.__stdout__
       print ""
       print "(also wrote HTML output to " + opts.html_output_file + ")"
+    if opts.trace_file != "":
+      incumbents.write_trace(opts.trace_file)
+      print "(also wrote the conflicts over time to " + opts.trace_file + ")"
+
+    if opts.profile_file != "":
+      profiler.disable()
+      profiler.dump_stats(opts.profile_file)
+      print "(also wrote profiling statistics to " + opts.profile_file + ")"
+    if opts.metrics_file != "":
+      metrics.write_json(opts.metrics_file)
+      print "(also wrote per-phase metrics to " + opts.metrics_file + ")"
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# Splits oversubscribed courses into sections: for each course with more
+# students than its capacity, chooses slots for the extra sections (among
+# the slots its teacher is free in) and which students go to which
+# section, so as to cause the fewest conflicts. The rest of the schedule
+# stays as it is.
+#
+# Each course is a small ILP over its own students and its teacher's free
+# slots, with students grouped by the slots they are busy in; courses are
+# split one after another, largest first, each seeing the sections chosen
+# for the ones before it.
+#
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from course_selection import write_schedule_file, pairs_in_slot
+from check_schedule import format_list, lastname
+from optparse import OptionParser
+from pulp import LpProblem, LpMinimize, LpVariable, LpInteger, LpBinary, \
+    LpStatus, lpSum, value, solvers
+import input_cache
+
+def read_capacities(path):
+    """Per-course capacities, from lines like "Chemistry: 24"."""
+    capacities = {}
+    for line in open(path):
+        if line.strip() == "": continue
+        course, capacity = line.rsplit(":", 1)
+        capacities[course.strip()] = int(capacity)
+    return capacities
+
+def split_course(students, busy, home_slot, open_slots, capacity):
+    """Choose slots for the sections of one course and put students in them.
+
+    busy[student][slot] is the number of the student's courses in the slot,
+    this one included (in home_slot, where its first section stays). Returns
+    {slot: [students]} for home_slot and the new sections' slots, or None if
+    there aren't enough open slots."""
+    num_sections = (len(students) + capacity - 1) // capacity
+    if len(open_slots) < num_sections - 1:
+        return None
+    slots = [home_slot] + list(open_slots)
+    def cost(student, slot): # -- conflicts from taking the section in slot.
+        return busy[student].get(slot, 0) - (slot == home_slot)
+    if num_sections == 2:
+        return split_in_two(students, cost, home_slot, open_slots, capacity)
+
+    # Students with the same costs are interchangeable, so the variables
+    # are per group: how many of the group go to each slot.
+    groups = {}
+    for student in students:
+        groups.setdefault(tuple([cost(student, s) for s in slots]), []) \
+            .append(student)
+    keys = sorted(groups)
+
+    prob = LpProblem("sections", LpMinimize)
+    take = dict(((g, i), LpVariable("take_%d_%d" % (g, i), 0,
+                                    len(groups[key]), LpInteger)) \
+                for g, key in enumerate(keys) for i in range(len(slots)))
+    used = dict((i, LpVariable("used_%d" % i, 0, 1, LpBinary)) \
+                for i in range(1, len(slots)))
+    prob += lpSum([key[i] * take[g, i] for g, key in enumerate(keys) \
+                   for i in range(len(slots))])
+    for g, key in enumerate(keys):
+        prob += lpSum([take[g, i] for i in range(len(slots))]) \
+            == len(groups[key]), "group %d placed" % g
+    prob += lpSum([take[g, 0] for g in range(len(keys))]) <= capacity, \
+        "home section capacity"
+    for i in range(1, len(slots)):
+        prob += lpSum([take[g, i] for g in range(len(keys))]) \
+            <= capacity * used[i], "section %d capacity" % i
+    prob += lpSum(used.values()) == num_sections - 1, "new sections"
+    prob.solve(solvers.COIN_CMD(msg=0))
+    if LpStatus[prob.status] != "Optimal":
+        return None
+
+    sections = {}
+    for g, key in enumerate(keys):
+        members = sorted(groups[key], key=lastname)
+        for i, slot in enumerate(slots):
+            count = int(round(value(take[g, i])))
+            if count > 0:
+                sections.setdefault(slot, []).extend(members[:count])
+                members = members[count:]
+    sections.setdefault(home_slot, [])
+    return sections
+
+def split_in_two(students, cost, home_slot, open_slots, capacity):
+    """The common case of split_course, without an ILP: for each slot the
+    second section could go in, the students who gain the most by moving
+    go, as many as fit (and at least as many as don't fit at home)."""
+    best = None
+    for slot in open_slots:
+        gains = sorted([(cost(s, slot) - cost(s, home_slot), lastname(s), s) \
+                        for s in students])
+        wanting = len([g for g in gains if g[0] < 0])
+        moving = max(len(students) - capacity, min(wanting, capacity))
+        total = sum([g[0] for g in gains[:moving]])
+        if best is None or total < best[0]:
+            best = (total, slot, [g[2] for g in gains[:moving]])
+    _total, slot, movers = best
+    staying = sorted(set(students) - set(movers), key=lastname)
+    return {home_slot: staying, slot: sorted(movers, key=lastname)}
+
+def split_sections(preferences, schedule, capacity_of):
+    """Split every scheduled course with more students than capacity_of
+    gives it. Returns (split, failed, conflicts before, conflicts after):
+    split is [(course, teacher, {slot: [students]})] for the courses split
+    and failed is [(course, reason)] for those that couldn't be."""
+    busy = {} # -- busy[student][slot] == the student's courses in the slot.
+    for student, courses in preferences.people.items():
+        counts = busy[student] = {}
+        for course, _comment in courses:
+            slot = schedule.courses.get(course)
+            if slot is not None: counts[slot] = counts.get(slot, 0) + 1
+    teacher_of, taken = {}, {} # -- taken[teacher] == slots not open to them.
+    for slot, row in schedule.timeslots.items():
+        for teacher, course in row.items():
+            teacher_of[course] = teacher
+            taken.setdefault(teacher, set()).add(slot)
+    for teacher, slots in schedule.bad_slots.items():
+        taken.setdefault(teacher, set()).update(slots)
+    def total_conflicts():
+        return sum([pairs_in_slot(n) for counts in busy.values() \
+                    for n in counts.values()])
+    before = total_conflicts()
+
+    oversubscribed = [(len(preferences.classes.get(c, ())) - capacity_of(c), c) \
+                      for c in schedule.courses \
+                      if len(preferences.classes.get(c, ())) > capacity_of(c)]
+    oversubscribed.sort(key=lambda (excess, course): (-excess, course))
+    split, failed = [], []
+    for _excess, course in oversubscribed:
+        teacher, home_slot = teacher_of[course], schedule.courses[course]
+        open_slots = [s for s in schedule.slotlist if s not in taken[teacher]]
+        students = sorted(preferences.classes[course])
+        sections = split_course(students, busy, home_slot, open_slots,
+                                capacity_of(course))
+        if sections is None:
+            failed.append((course, "%s has only %d free slots" \
+                           % (teacher, len(open_slots))))
+            continue
+        for slot, members in sections.items():
+            if slot == home_slot: continue
+            taken[teacher].add(slot)
+            for student in members: # -- they've moved out of home_slot.
+                busy[student][home_slot] -= 1
+                busy[student][slot] = busy[student].get(slot, 0) + 1
+        split.append((course, teacher, sections))
+    return split, failed, before, total_conflicts()
+
+def section_name(course, number):
+    return "%s #%d" % (course, number)
+
+if __name__=="__main__":
+    usage = "%prog [options] <preferences> <schedule>\n%prog [options] -p <preference file> <schedule>"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-p', '--preferences', dest="preference_file", default="",
+                      help="obtain student preferences from single file")
+    parser.add_option('-c', '--capacity', type="int", default=30,
+                      help="most students in a section (default 30)")
+    parser.add_option('--capacities', dest="capacity_file", default="",
+                      help="file of per-course capacities, one 'course: number' per line")
+    parser.add_option('-o', '--outfile', dest="output_file", default="",
+                      help="write the schedule with the new sections to this file")
+    parser.add_option('--no-cache', dest="cache", action="store_false",
+                      default=True, help="always re-read the input files")
+    (opts, args) = parser.parse_args()
+    input_cache.enabled = opts.cache
+
+    if opts.preference_file != "":
+        if len(args) != 1:
+            parser.error("one argument required with option '-p': schedule")
+        offering, preferences = input_cache.load_combined_file(opts.preference_file)
+    else:
+        if len(args) != 2:
+            parser.error("two arguments required: student preferences, and schedule")
+        preferences = input_cache.load_preferences(args[0])
+    schedule = input_cache.load_schedule(args[-1], True)
+    capacities = {}
+    if opts.capacity_file != "":
+        capacities = read_capacities(opts.capacity_file)
+    capacity_of = lambda course: capacities.get(course, opts.capacity)
+
+    split, failed, before, after = \
+        split_sections(preferences, schedule, capacity_of)
+
+    rank = dict((s, i) for i, s in enumerate(schedule.slotlist))
+    for course, teacher, sections in split:
+        print "%s (%s): %d students, capacity %d, %d sections" \
+            % (course, teacher, sum([len(m) for m in sections.values()]),
+               capacity_of(course), len(sections))
+        for number, slot in enumerate(sorted(sections, key=rank.get), 1):
+            print "\tSection %d at %s, %d students: %s" % (number, slot,
+                len(sections[slot]), format_list(sections[slot]))
+        print ""
+    for course, reason in failed:
+        print "COULD NOT SPLIT: %s (%s)" % (course, reason)
+    print "%d courses split; %d conflicts before, %d with the new sections." \
+        % (len(split), before, after)
+
+    if opts.output_file != "":
+        # -- the first section keeps its name; the others are numbered.
+        for course, teacher, sections in split:
+            home_slot = schedule.courses[course]
+            new_slots = [s for s in sorted(sections, key=rank.get) \
+                         if s != home_slot]
+            for number, slot in enumerate(new_slots, 2):
+                schedule.add(teacher, section_name(course, number), slot)
+        teachers = sorted(set([t for row in schedule.timeslots.values() \
+                               for t in row]) | set(schedule.bad_slots))
+        write_schedule_file(opts.output_file, schedule, teachers)
+        print ""
+        print "(also wrote the schedule with the new sections to %s)" \
+            % opts.output_file
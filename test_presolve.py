@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Checks for presolve.py and how gen_schedules uses it. Run with
+# "python -m unittest test_presolve" (or pytest).
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+import unittest
+from presolve import presolve
+from heuristics import dsatur_assignment, order_slot_groups
+
+def overlap_of(students):
+    """The (ordered-pair) overlap table of gen_schedules, from a dict of
+    {course: [students]}."""
+    overlap = {}
+    for course1, people1 in students.items():
+        for course2, people2 in students.items():
+            shared = len(set(people1) & set(people2))
+            if course1 != course2 and shared: overlap[course1, course2] = shared
+    return overlap
+
+def breaks_seen_rows(assignment, slot_group, model_order):
+    """Whether assignment breaks row (6) of gen_schedules for the group:
+    every course of the model in a slot must come after (in model_order)
+    some course of the model in the slot before."""
+    for prev_slot, slot in zip(slot_group[:-1], slot_group[1:]):
+        if assignment[model_order[0]] == slot: return True
+        for i, course in enumerate(model_order[1:], 1):
+            if assignment[course] == slot and not [c for c in model_order[:i] \
+                    if assignment[c] == prev_slot]:
+                return True
+    return False
+
+class TemplateEntries(unittest.TestCase):
+    def test_course_nobody_offers_is_ignored(self):
+        presolved = presolve(["A", "B"], ["s1", "s2"],
+                             {"T1": ["A"], "T2": ["B"]}, {},
+                             [("s1", "A"), ("s2", "Z")], [])
+        self.assertEqual(presolved.fixed, {"A": "s1"})
+        self.assertEqual(presolved.infeasible, [])
+
+class SymmetryBreakingStart(unittest.TestCase):
+    # Five single-course teachers and three interchangeable slots; course
+    # "A" shares no students, so presolve sets it aside, and it comes first.
+    slots = ["s1", "s2", "s3"]
+    teacher_courses = dict(("T%d" % i, [c]) for i, c in enumerate("ABCDE"))
+    students = {"A": ["S9"], "B": ["S1", "S2", "S3"], "C": ["S1", "S4", "S5"],
+                "D": ["S2", "S4", "S6"], "E": ["S1", "S3", "S5", "S6"]}
+
+    def test_start_obeys_seen_rows_with_courses_set_aside(self):
+        overlap = overlap_of(self.students)
+        course_order = sorted(self.students)
+        presolved = presolve(course_order, self.slots, self.teacher_courses,
+                             overlap, [], [])
+        self.assertEqual(presolved.set_aside, ["A"])
+        start = dsatur_assignment(course_order, self.slots,
+                                  self.teacher_courses, overlap, [], [])
+        start = order_slot_groups(start, [self.slots], presolved.courses)
+        self.assertEqual(sorted(start), course_order)
+        self.assertFalse(breaks_seen_rows(start, self.slots, presolved.courses))
+
+if __name__ == "__main__":
+    unittest.main()
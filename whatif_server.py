@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# Keeps the preferences and a schedule in memory and answers "what if"
+# questions about changes to the schedule over HTTP, on localhost or on a
+# Unix socket, e.g.:
+#
+#   ./whatif_server.py -p preferences.txt schedule.txt &
+#   curl 'localhost:8642/move?course=Chemistry&slot=Tue+2'
+#   curl 'localhost:8642/swap?course=Chemistry&with=Biology&apply=1'
+#   curl 'localhost:8642/add?student=Jane+Doe&course=Chemistry'
+#   curl 'localhost:8642/remove?student=Jane+Doe&course=Chemistry'
+#   curl 'localhost:8642/conflicts'
+#   curl 'localhost:8642/save?path=new_schedule.txt'
+#
+# Each answer is a JSON object with the change in the number of conflicts
+# ("delta", counted as by check_schedule.py -c), the conflicts the change
+# would cause and resolve, formatted as in the report by course, and the
+# time taken, plus any teacher clashes or "X" marks a move runs into.
+# Nothing changes unless the query says apply=1.
+#
+# Provided under the terms of the MIT License, as stated in LICENSE.txt.
+
+from course_selection import Schedule, write_schedule_file, pairs_in_slot
+from check_schedule import ConflictIndex, group_problems, format_conflict, \
+    format_missing_course, format_list
+from optparse import OptionParser
+import BaseHTTPServer, SocketServer
+import os, sys, json, time, urlparse
+import input_cache
+
+class QueryError(ValueError):
+    pass
+
+def conflict_pairs(conflicts):
+    return sum([pairs_in_slot(len(courses)) for courses, _timeslot in conflicts])
+
+class WhatIf:
+    """The state of the server: everyone's course selections, where each
+    course is, and the current number of conflicts. Queries only look at
+    the students taking the courses involved."""
+
+    def __init__(self, preferences, schedule):
+        self.slotlist = list(schedule.slotlist)
+        self.index = ConflictIndex(schedule).moved({}) # -- ours to change.
+        self.teacher_of = {}
+        for timeslot, row in schedule.timeslots.items():
+            for teacher, course in row.items():
+                self.teacher_of[course] = teacher
+        self.courses_of = {}
+        for course, teacher in self.teacher_of.items():
+            self.courses_of.setdefault(teacher, []).append(course)
+        self.bad_slots = dict((t, list(s)) for t, s in schedule.bad_slots.items())
+        self.people = dict((p, list(c)) for p, c in preferences.people.items())
+        self.classes = dict((c, set(p)) for c, p in preferences.classes.items())
+        self.total = sum([conflict_pairs(self.index.problems_for_selection(c)[0]) \
+                          for c in self.people.values()])
+
+    def compare(self, students, changes={}, selections={}):
+        """Returns (delta, caused, resolved) for moving the courses in changes
+        and replacing the students' course lists with those in selections."""
+        index = self.index.moved(changes) if changes else self.index
+        delta, caused, resolved = 0, [], []
+        for student in students:
+            old_conflicts, old_missing = \
+                self.index.problems_for_selection(self.people.get(student, []))
+            new_conflicts, new_missing = index.problems_for_selection(
+                selections.get(student, self.people.get(student, [])))
+            delta += conflict_pairs(new_conflicts) - conflict_pairs(old_conflicts)
+            caused.append((student,
+                           [c for c in new_conflicts if c not in old_conflicts],
+                           [m for m in new_missing if m not in old_missing]))
+            resolved.append((student,
+                             [c for c in old_conflicts if c not in new_conflicts],
+                             [m for m in old_missing if m not in new_missing]))
+        return delta, self.formatted(caused), self.formatted(resolved)
+
+    def warnings(self, changes):
+        """Teacher clashes and "X" marks the moves in changes would run into."""
+        slot_of = self.index.slot_of
+        warnings = []
+        for course, timeslot in sorted(changes.items()):
+            teacher = self.teacher_of[course]
+            others = [c for c in self.courses_of[teacher] if c != course and \
+                      changes.get(c, slot_of.get(c)) == timeslot]
+            if others:
+                warnings.append("TEACHER CLASH: %s would teach %s at %s" \
+                    % (teacher, format_list(sorted(others + [course])), timeslot))
+            if timeslot in self.bad_slots.get(teacher, ()):
+                warnings.append("X MARK: %s can't come in at %s" \
+                                % (teacher, timeslot))
+        return warnings
+
+    def formatted(self, problems):
+        conflicts, missing_courses = group_problems(self.index, problems)
+        return [format_conflict(c) for c in conflicts] \
+            + [format_missing_course(m) for m in missing_courses]
+
+    # Queries; each returns (delta, caused, resolved, moves, apply function):
+
+    def scheduled(self, course):
+        if self.index.slot_of.get(course) is None:
+            raise QueryError("%s isn't in the schedule" % course)
+        return self.index.slot_of[course]
+
+    def query_move(self, params):
+        course, timeslot = params.get("course"), params.get("slot")
+        self.scheduled(course)
+        if timeslot not in self.index.slot_rank:
+            raise QueryError("no slot named %s" % timeslot)
+        changes = {course: timeslot}
+        result = self.compare(self.classes.get(course, ()), changes)
+        return result + (changes, lambda: self.index.slot_of.update(changes),)
+
+    def query_swap(self, params):
+        course1, course2 = params.get("course"), params.get("with")
+        changes = {course1: self.scheduled(course2),
+                   course2: self.scheduled(course1)}
+        students = self.classes.get(course1, set()) | \
+                   self.classes.get(course2, set())
+        result = self.compare(students, changes)
+        return result + (changes, lambda: self.index.slot_of.update(changes),)
+
+    def query_add(self, params):
+        student, course = params.get("student"), params.get("course")
+        if not student or not course:
+            raise QueryError("add needs a student and a course")
+        selection = self.people.get(student, [])
+        if course in [c for c, _comment in selection]:
+            raise QueryError("%s already takes %s" % (student, course))
+        selection = selection + [(course, "")]
+        def apply_change():
+            self.people[student] = selection
+            self.classes.setdefault(course, set()).add(student)
+        return self.compare([student], selections={student: selection}) \
+            + ({}, apply_change,)
+
+    def query_remove(self, params):
+        student, course = params.get("student"), params.get("course")
+        selection = self.people.get(student, [])
+        if course not in [c for c, _comment in selection]:
+            raise QueryError("%s doesn't take %s" % (student, course))
+        selection = [(c, m) for c, m in selection if c != course]
+        def apply_change():
+            self.people[student] = selection
+            self.classes[course].discard(student)
+        return self.compare([student], selections={student: selection}) \
+            + ({}, apply_change,)
+
+    def query(self, name, params):
+        started = time.time()
+        if name == "status":
+            reply = {"conflicts": self.total, "students": len(self.people),
+                     "courses": len([c for c, s in self.index.slot_of.items() \
+                                     if s is not None]),
+                     "slots": len(self.slotlist)}
+        elif name == "conflicts":
+            problems = ((student,) + self.index.problems_for_selection(courses) \
+                        for student, courses in self.people.items())
+            conflicts, missing_courses = group_problems(self.index, problems)
+            reply = {"conflicts": self.total,
+                     "report": [format_conflict(c) for c in conflicts],
+                     "missing": [format_missing_course(m) \
+                                 for m in missing_courses]}
+        elif name == "save":
+            if not params.get("path"):
+                raise QueryError("save needs a path")
+            placed = dict((c, s) for c, s in self.index.slot_of.items() \
+                          if s is not None)
+            clashes = sorted(set([w for w in self.warnings(placed) \
+                                  if w.startswith("TEACHER CLASH")]))
+            if clashes: # -- a schedule file has one course per teacher and slot.
+                raise QueryError("can't save with teacher clashes: " \
+                                 + "; ".join(clashes))
+            schedule = self.current_schedule()
+            teachers = sorted(set(self.teacher_of.values()) | set(self.bad_slots))
+            write_schedule_file(params["path"], schedule, teachers)
+            reply = {"saved": params["path"], "conflicts": self.total}
+        elif hasattr(self, "query_" + name):
+            delta, caused, resolved, changes, apply_change = \
+                getattr(self, "query_" + name)(params)
+            applied = params.get("apply", "0") not in ["", "0", "no", "false"]
+            warnings = self.warnings(changes)
+            if applied:
+                apply_change()
+                self.total += delta
+            reply = {"delta": delta, "caused": caused, "resolved": resolved,
+                     "applied": applied, "warnings": warnings,
+                     "conflicts": self.total if applied else self.total + delta}
+        else:
+            raise QueryError("unknown query %s" % name)
+        reply["milliseconds"] = round((time.time() - started) * 1000, 3)
+        return reply
+
+    def current_schedule(self):
+        schedule = Schedule()
+        schedule.slotlist = list(self.slotlist)
+        for course, timeslot in sorted(self.index.slot_of.items()):
+            if timeslot is not None:
+                schedule.add(self.teacher_of[course], course, timeslot)
+        for teacher, slots in self.bad_slots.items():
+            for timeslot in slots: schedule.add_bad_slot(teacher, timeslot)
+        return schedule
+
+class WhatIfHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query).items())
+        try:
+            reply, code = self.server.whatif.query(url.path.strip("/"), params), 200
+        except QueryError, e:
+            reply, code = {"error": str(e)}, 400
+        except (IOError, OSError), e:
+            reply, code = {"error": str(e)}, 500
+        body = json.dumps(reply, indent=2, sort_keys=True) + "\n"
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            sys.stderr.write("%s\n" % (format % args))
+
+class UnixHTTPServer(SocketServer.UnixStreamServer):
+    def get_request(self):
+        request, _address = self.socket.accept()
+        return request, ("local", 0) # -- what the request handler expects.
+
+if __name__=="__main__":
+    usage = "%prog [options] <preferences> <schedule>\n%prog [options] -p <preference file> <schedule>"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-p', '--preferences', dest="preference_file", default="",
+                      help="obtain student preferences from single file")
+    parser.add_option('--port', type="int", default=8642,
+                      help="answer on this port of localhost (default 8642)")
+    parser.add_option('--socket', default="",
+                      help="answer on this Unix socket instead")
+    parser.add_option('-v', '--verbose', action="store_true", default=False,
+                      help="log each request")
+    parser.add_option('--no-cache', dest="cache", action="store_false", \
+                      default=True, help="always re-read the input files")
+    (opts, args) = parser.parse_args()
+    input_cache.enabled = opts.cache
+
+    if opts.preference_file != "":
+        if len(args) != 1:
+            parser.error("one argument required with option '-p': schedule")
+        offering, preferences = input_cache.load_combined_file(opts.preference_file)
+    else:
+        if len(args) != 2:
+            parser.error("two arguments required: student preferences, and schedule")
+        preferences = input_cache.load_preferences(args[0])
+    schedule = input_cache.load_schedule(args[-1], True)
+    whatif = WhatIf(preferences, schedule)
+
+    if opts.socket:
+        if os.path.exists(opts.socket): os.remove(opts.socket)
+        server = UnixHTTPServer(opts.socket, WhatIfHandler)
+        where = opts.socket
+    else:
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", opts.port), WhatIfHandler)
+        where = "http://127.0.0.1:%d/" % opts.port
+    server.whatif, server.verbose = whatif, opts.verbose
+    print "Loaded %d students and %d scheduled courses, %d conflicts." \
+        % (len(whatif.people), len(schedule.courses), whatif.total)
+    print "Answering on %s (Ctrl-C to stop)." % where
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if opts.socket and os.path.exists(opts.socket): os.remove(opts.socket)